@@ -0,0 +1,52 @@
+'''
+Checks that batch.getBatchResults agrees with the >player report
+on every field, for synthetic players at each scale.
+Exits with an error if a field differs by more than the tolerance.
+
+Usage: python benchmarks/check.py [--scale low mid endgame] [--players 50]
+                                  [--tolerance 1e-9]
+'''
+import argparse
+import os
+import sys
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "bot"))
+
+import batch
+import report
+import fixtures
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Check batch.py against the >player report")
+  parser.add_argument("--scale", nargs="+", choices=list(fixtures.SCALES), default=list(fixtures.SCALES))
+  parser.add_argument("--players", type=int, default=50, help="Players per scale")
+  parser.add_argument("--tolerance", type=float, default=1e-9, help="Largest relative difference allowed")
+  args = parser.parse_args()
+
+  mismatches = []
+  print("{:<8} {:<24} {:>14}".format("scale", "field", "worst diff"))
+  for scale in args.scale:
+    players = [fixtures.make_player(scale, seed) for seed in range(args.players)]
+    results = batch.getBatchResults(players, fixtures.PRICES)
+    reports = [report.compute_investment_report(data, fixtures.PRICES) for data in players]
+
+    for field in batch.RESULT_FIELDS:
+      worst = 0
+      for i, r in enumerate(reports):
+        expected = getattr(r, field)
+        worst = max(worst, abs(results[field][i] - expected) / max(1, abs(expected)))
+      flag = ""
+      if worst > args.tolerance:
+        mismatches.append("{}/{}".format(scale, field))
+        flag = " !"
+      print("{:<8} {:<24} {:>14.2e}{}".format(scale, field, worst, flag))
+
+  if mismatches:
+    print("Batch results differ from the report: {}".format(", ".join(mismatches)))
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+  main()
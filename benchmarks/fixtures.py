@@ -0,0 +1,129 @@
+import random
+from datetime import datetime, timedelta
+
+# Synthetic player/full payloads for the benchmarks.
+# Each scale sets the ranges that the levels and counts are drawn from.
+SCALES = {
+  "low": {
+    "units": (2, 3), "unitLevel": (0, 30), "stat": (5000, 20000), "skill": (10, 500),
+    "house": (10, 60), "relic": (50, 1000), "homestead": (1, 200), "cave": (0, 20),
+    "eqSlot": (0, 20), "petFarm": (0, 50), "building": (0, 20), "enchant": (0, 50), "frenzy": (0, 2)
+  },
+  "mid": {
+    "units": (6, 10), "unitLevel": (50, 300), "stat": (150000, 500000), "skill": (1000, 5000),
+    "house": (300, 800), "relic": (3000, 9000), "homestead": (500, 1500), "cave": (50, 200),
+    "eqSlot": (40, 80), "petFarm": (200, 800), "building": (50, 150), "enchant": (200, 800), "frenzy": (5, 15)
+  },
+  "endgame": {
+    "units": (20, 25), "unitLevel": (500, 1500), "stat": (2000000, 6000000), "skill": (8000, 20000),
+    "house": (2000, 4000), "relic": (20000, 30000), "homestead": (1800, 3000), "cave": (400, 1000),
+    "eqSlot": (100, 150), "petFarm": (2000, 5000), "building": (200, 400), "enchant": (1500, 3000), "frenzy": (25, 40)
+  }
+}
+
+TILE_TYPES = ["gold", "resource", "drop", "village", "mystery", "experience"]
+ENCHANT_TYPES = ["gold", "experience", "drop", "stat", "meat", "iron", "wood", "stone"]
+TIMESTAMP = "%Y-%m-%dT%H:%M:%S.000Z"
+
+
+def make_tile(rng, id):
+  major = rng.random() < 0.3
+  tile = {"id": id, "type": "Major" if major else "Minor", "name": "Plains"}
+  for number in ["one", "two", "three"]:
+    tile["resource_{}_type".format(number)] = rng.choice(TILE_TYPES) if major or number == "one" else None
+    tile["resource_{}_value".format(number)] = rng.randint(1, 10)
+  return tile
+
+
+def make_player(scale, seed=0):
+  '''
+  Returns a player/full payload with levels drawn from the scale's ranges
+  '''
+  ranges = SCALES[scale]
+  rng = random.Random("{}-{}".format(scale, seed))
+  def roll(field):
+    return rng.randint(*ranges[field])
+
+  future = (datetime.utcnow() + timedelta(days=7)).strftime(TIMESTAMP)
+  past = (datetime.utcnow() - timedelta(days=7)).strftime(TIMESTAMP)
+  units = roll("units")
+
+  partners = []
+  for _ in range(units):
+    partner = {"speed": roll("unitLevel"), "intelligence": roll("unitLevel"), "action_id": rng.randint(1, 4)}
+    for skill in ["hunting", "mining", "woodcutting", "stonecarving"]:
+      partner[skill] = roll("skill")
+    for stat in ["strength", "health", "agility", "dexterity"]:
+      partner[stat] = roll("stat") // 10
+    partners.append(partner)
+
+  fighters = [
+    {stat: roll("unitLevel") for stat in ["health", "damage", "hit", "dodge", "defense", "crit_damage"]}
+    for _ in range(units)
+  ]
+
+  equipment = []
+  for _ in range(7):
+    piece = {
+      "enchant_type": rng.choice(ENCHANT_TYPES), "enchant_value": roll("enchant"), "slot_tier": rng.randint(0, 10),
+      "gem_type": rng.choice(["frenzy", "gold", "drop"]), "gem_value": rng.uniform(*ranges["frenzy"]),
+      "gem_splinter_type": rng.choice(["frenzy", "resource"]), "gem_splinter_time": rng.choice([future, past]),
+      "gem_level": roll("frenzy")
+    }
+    for stat in ["strength", "health", "agility", "dexterity", "damage", "defense"]:
+      piece[stat] = roll("stat") // 100
+      piece[stat + "_tier"] = rng.randint(0, 10)
+    equipment.append(piece)
+
+  return {
+    "currency": {
+      "id": rng.randint(1, 99999), "gold": roll("stat") * 10**5, "bank_gold": roll("stat") * 10**5,
+      "credits": roll("skill"), "bank_credits": roll("skill"),
+      "relics": roll("stat") * 100, "bank_relics": roll("stat") * 100,
+      "shattered_partner_gold": roll("stat") * 1000, "shattered_fighter_gold": roll("stat") * 1000,
+      "shattered_battling_relics": roll("stat"), "shattered_partner_relics": roll("stat")
+    },
+    "village": {
+      "overview": {"name": "Benchmark Village"},
+      "boosts": {building: roll("building") for building in ["market", "mill", "well"]},
+      "tiles": [make_tile(rng, id) for id in range(1, 8)]
+    },
+    "player": {"username": "{}{}".format(scale, seed), "vip_time": rng.choice([future, past, "0000-00-00 00:00:00"])},
+    "skills": {"battling": roll("skill")},
+    "stats": {stat: roll("stat") for stat in ["strength", "health", "agility", "dexterity"]},
+    "partners": partners,
+    "pets": [{} for _ in range(units)],
+    "playerPetsData": {farm: roll("petFarm") for farm in ["farm_strength", "farm_health", "farm_agility", "farm_dexterity"]},
+    "fighters": fighters,
+    "equipmentSlots": {slot: roll("eqSlot") for slot in [
+      "left_hand_level", "right_hand_level", "head_level", "body_level", "hands_level", "legs_level", "feet_level"]},
+    "fighterCaveTools": {tool: roll("cave") for tool in [
+      "archeology", "brush", "trowel", "map", "backpack", "torch", "scouting", "spade", "knife", "compass"]},
+    "boosts": {boost: roll("relic") for boost in [
+      "critChance", "critDamage", "multistrike", "healing", "defense",
+      "hunting_boost", "mining_boost", "woodcutting_boost", "stonecarving_boost"]},
+    "house": {deco: roll("house") for deco in [
+      "chairs", "stove", "sink", "basket", "pitchfork", "shed", "fountain", "tools", "barrel",
+      "table", "candlestick", "carpet", "couch"]},
+    "playerHomesteadData": {
+      "fishing_level": roll("homestead"), "mine_level": roll("homestead"),
+      "logging_level": roll("homestead"), "farm_level": roll("homestead"), "plots": rng.randint(1, 6)
+    },
+    "playerHomesteadDecorations": [{"pet_exp_boost": rng.randint(0, 5)} for _ in range(3)],
+    "equipmentEquipped": equipment,
+    "actions": {"monster_id": rng.randint(1, 2500)},
+    "kingdom": {
+      "explorationBoosts": {"gold": rng.randint(0, 50), "resource": rng.randint(0, 50), "drop": rng.randint(0, 50)},
+      "tiles": [make_tile(rng, id) for id in sorted(rng.sample(range(1, 26), 12))],
+      "mapMisc": {"mystery_tile": rng.choice(["gold", "resource", "drop"])},
+      "activeExploration": {"cost": rng.randint(0, 20), "exploration_timer": future}
+    },
+    "partyPvPData": {"gold": rng.randint(0, 30), "resource": rng.randint(0, 30), "drop": rng.randint(0, 30)},
+    "playerFighterData": {"dungeon_level": roll("building")}
+  }
+
+
+PRICES = {
+  "meat": "130.5", "iron": "142.0", "wood": "118.25", "stone": "125.0",
+  "relics": "910.0", "diamonds": "52000.0"
+}
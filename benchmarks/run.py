@@ -0,0 +1,193 @@
+'''
+Benchmarks the calculator functions and the >player report build on
+synthetic payloads. Everything runs offline, with no Discord or API access.
+
+Usage: python benchmarks/run.py [--scale low mid endgame] [--filter name]
+                                [--save] [--baseline path] [--threshold 0.25]
+'''
+import argparse
+import json
+import os
+import sys
+import time
+import types
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "bot"))
+
+import calculator as calc
+import batch
+import report
+from market import Market
+from qsBot import QueslarBot
+import fixtures
+
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "baseline.json")
+ROSTER_SIZE = 30
+
+
+def run_sync(coro):
+  '''
+  Runs a coroutine that never suspends, without an event loop
+  '''
+  try:
+    coro.send(None)
+  except StopIteration as done:
+    return done.value
+  raise RuntimeError("The benchmarked coroutine tried to wait on I/O")
+
+
+def make_report_bot(data):
+  '''
+  Returns a stand-in for the bot with the market and API stubbed out
+  '''
+  market = Market(None, None)
+  market.prices = dict(fixtures.PRICES)
+
+  async def refresh_market():
+    return True
+
+  async def get_qs_data(key):
+    return data
+
+  return types.SimpleNamespace(market=market, refresh_market=refresh_market, get_qs_data=get_qs_data)
+
+
+def get_cases(data, roster):
+  '''
+  Returns (name, function, list of argument tuples) for every benchmark.
+  Latency is reported per function call.
+  '''
+  prices = fixtures.PRICES
+  matPrice = sum(float(prices[res]) for res in ["meat", "iron", "wood", "stone"])
+  gold = calc.getEnchantBoost(data["equipmentEquipped"], "gold")
+  drop = calc.getEnchantBoost(data["equipmentEquipped"], "drop")
+  bot = make_report_bot(data)
+  investments = report.compute_investment_report(data, prices)
+
+  def render():
+    investments.text = None #Skip the cached text
+    return report.render_investment_report(investments)
+
+  return [
+    ("getRelicInvestment", calc.getRelicInvestment,
+      [(level,) for level in data["boosts"].values()]),
+    ("getHomesteadInvestment", calc.getHomesteadInvestment,
+      [(level,) for key, level in data["playerHomesteadData"].items() if key != "plots"]),
+    ("getHouseInvestment", calc.getHouseInvestment,
+      [(data["house"][deco],) for deco in calc.HOUSE_UPGRADES] +
+      [(data["house"][deco], 5000000) for deco in calc.LIVING_ROOM]),
+    ("getPartnerInvestment", calc.getPartnerInvestment,
+      [(partner["speed"], partner["intelligence"]) for partner in data["partners"]]),
+    ("getFighterInvestment", calc.getFighterInvestment,
+      [(fighter,) for fighter in data["fighters"]]),
+    ("getPetInvestment", calc.getPetInvestment, [(data["playerPetsData"],)]),
+    ("getEqSlotInvestment", calc.getEqSlotInvestment,
+      [([data["equipmentSlots"][slot] for slot in batch.EQ_SLOTS],)]),
+    ("getCaveInvestment", calc.getCaveInvestment,
+      [(level, matPrice, prices["diamonds"]) for level in data["fighterCaveTools"].values()]),
+    ("getBaseRes", calc.getBaseRes,
+      [(data["stats"][stat],) for stat in batch.RES_STATS]),
+    ("getHouseBoost", calc.getHouseBoost,
+      [(data["house"][deco],) for deco in batch.RES_HOUSE_UPGRADES]),
+    ("getBuildingBoost", calc.getBuildingBoost,
+      [(level,) for level in data["village"]["boosts"].values()]),
+    ("getPersonalGoldIncome", calc.getPersonalGoldIncome, [(data, gold)]),
+    ("getPersonalGoldIncomes x50", calc.getPersonalGoldIncomes, [(data, gold, range(50))]),
+    ("getPartnerResIncomeHr", calc.getPartnerResIncomeHr, [(data,)]),
+    ("getRelicIncomeHr", calc.getRelicIncomeHr, [(data, drop)]),
+    ("compute report", report.compute_investment_report, [(data, prices)]),
+    ("render report", render, [()]),
+    ("player report (cached)", lambda: run_sync(QueslarBot.get_player_investments(bot, "key")), [()]),
+    ("batch roster x{}".format(ROSTER_SIZE), batch.getBatchResults, [(roster, prices)]),
+  ]
+
+
+def time_case(function, argsList, minTime, repeat):
+  '''
+  Returns the best seconds per call over repeat runs,
+  each lasting at least minTime seconds
+  '''
+  for args in argsList: #Warm up, this also fills the lookup tables
+    function(*args)
+
+  loops = 1
+  while True:
+    start = time.perf_counter()
+    for _ in range(loops):
+      for args in argsList:
+        function(*args)
+    elapsed = time.perf_counter() - start
+    if elapsed >= minTime:
+      break
+    loops *= 2
+
+  best = elapsed
+  for _ in range(repeat - 1):
+    start = time.perf_counter()
+    for _ in range(loops):
+      for args in argsList:
+        function(*args)
+    best = min(best, time.perf_counter() - start)
+  return best / (loops * len(argsList))
+
+
+def format_time(seconds):
+  if seconds >= 1e-3:
+    return "{:.2f} ms".format(seconds * 1e3)
+  return "{:.2f} us".format(seconds * 1e6)
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Benchmark calculator.py and the >player report")
+  parser.add_argument("--scale", nargs="+", choices=list(fixtures.SCALES), default=list(fixtures.SCALES))
+  parser.add_argument("--filter", default="", help="Only run cases whose name contains this")
+  parser.add_argument("--save", action="store_true", help="Save the results as the new baseline")
+  parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+  parser.add_argument("--threshold", type=float, default=0.25, help="Slowdown that counts as a regression")
+  parser.add_argument("--min-time", type=float, default=0.1, help="Minimum seconds per timing run")
+  parser.add_argument("--repeat", type=int, default=3)
+  args = parser.parse_args()
+
+  baseline = {}
+  if os.path.exists(args.baseline):
+    with open(args.baseline) as f:
+      baseline = json.load(f)
+
+  results = {}
+  regressions = []
+  print("{:<8} {:<24} {:>12} {:>14} {:>12} {:>8}".format(
+    "scale", "case", "per call", "calls/s", "baseline", "change"))
+  for scale in args.scale:
+    data = fixtures.make_player(scale)
+    roster = [fixtures.make_player(scale, seed) for seed in range(ROSTER_SIZE)]
+    for name, function, argsList in get_cases(data, roster):
+      if args.filter not in name:
+        continue
+      key = "{}/{}".format(scale, name)
+      seconds = time_case(function, argsList, args.min_time, args.repeat)
+      results[key] = seconds
+
+      old, change = baseline.get(key), ""
+      if old:
+        ratio = seconds / old - 1
+        change = "{:+.1%}".format(ratio)
+        if ratio > args.threshold:
+          regressions.append(key)
+          change += " !"
+      print("{:<8} {:<24} {:>12} {:>14,.0f} {:>12} {:>8}".format(
+        scale, name, format_time(seconds), 1 / seconds, format_time(old) if old else "-", change))
+
+  if args.save:
+    baseline.update(results)
+    with open(args.baseline, "w") as f:
+      json.dump(baseline, f, indent=2, sort_keys=True)
+    print("Saved baseline to {}".format(args.baseline))
+
+  if regressions:
+    print("Regressions over {:.0%}: {}".format(args.threshold, ", ".join(regressions)))
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+  main()
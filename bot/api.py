@@ -0,0 +1,152 @@
+import aiohttp
+import asyncio
+import os
+import time
+import metrics
+
+API_URL = "https://queslar.com/api/"
+RETRY_BACKOFF = 1 #Seconds before the first retry, doubled on every retry
+
+class QueslarClient:
+  '''
+  A long-lived client for the Queslar API. Connections are pooled and
+  kept alive, so requests after the first skip the TCP/TLS handshake.
+  '''
+  def __init__(self):
+    self.session = None #Created on first use, inside the event loop
+    self.connectionLimit = int(os.getenv("QS_CONNECTION_LIMIT", 10))
+    self.timeout = aiohttp.ClientTimeout(
+      connect=float(os.getenv("QS_CONNECT_TIMEOUT", 5)),
+      sock_read=float(os.getenv("QS_READ_TIMEOUT", 20))
+    )
+
+    # Player responses are cached per key for playerTtl seconds
+    self.playerTtl = float(os.getenv("QS_PLAYER_CACHE_TTL", 60))
+    self.playerCache = {} #key -> (expiry, data)
+    self.inFlight = {} #key -> running request, shared by concurrent callers
+    self.cacheHits = 0
+    self.cacheCoalesced = 0
+    self.cacheMisses = 0
+
+
+  def get_session(self):
+    '''
+    Returns the shared session, opening it if needed
+    '''
+    if self.session is None or self.session.closed:
+      connector = aiohttp.TCPConnector(
+        limit_per_host=self.connectionLimit,
+        keepalive_timeout=60,
+        ttl_dns_cache=300
+      )
+      self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+    return self.session
+
+
+  async def get_json(self, path, default, retries=0):
+    '''
+    Returns the decoded response of the API endpoint,
+    or default if the request failed.
+    Server errors, rate limits and network errors are retried
+    up to retries times with exponential backoff.
+    '''
+    endpoint = path.rsplit("/", 1)[0] #Without the key
+    for attempt in range(retries + 1):
+      if attempt > 0:
+        await asyncio.sleep(RETRY_BACKOFF * 2**(attempt - 1))
+      start = time.perf_counter()
+      try:
+        async with self.get_session().get(API_URL + path) as res:
+          if res.status == 200:
+            data = await res.json()
+            metrics.apiRequests.inc(endpoint=endpoint, status=res.status)
+            return data
+
+          metrics.apiRequests.inc(endpoint=endpoint, status=res.status)
+          print("Server error: {}".format(res.status))
+          if res.status < 500 and res.status != 429:
+            return default #Retrying will not help, e.g. an invalid key
+      except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        metrics.apiRequests.inc(endpoint=endpoint, status=type(e).__name__)
+        print("Request error: {}".format(type(e).__name__))
+      finally:
+        metrics.apiSeconds.observe(time.perf_counter() - start, endpoint=endpoint)
+    return default
+
+
+  async def get_player(self, key, retries=0):
+    '''
+    Returns player data from the API server. Recent responses are
+    served from the cache, and callers asking for a key that is
+    already being fetched wait for that request instead.
+    '''
+    cached = self.playerCache.get(key)
+    if cached and cached[0] > time.monotonic():
+      self.cacheHits += 1
+      metrics.playerCache.inc(result="hit")
+      return cached[1]
+
+    if key in self.inFlight:
+      self.cacheCoalesced += 1
+      metrics.playerCache.inc(result="coalesced")
+    else:
+      self.cacheMisses += 1
+      metrics.playerCache.inc(result="miss")
+      self.inFlight[key] = asyncio.ensure_future(self.fetch_player(key, retries))
+    # Shielded so one cancelled caller does not cancel the request for the others
+    return await asyncio.shield(self.inFlight[key])
+
+
+  async def fetch_player(self, key, retries=0):
+    '''
+    Requests player data and caches it if the request succeeded
+    '''
+    try:
+      data = await self.get_json("player/full/" + key, {}, retries)
+      if data and self.playerTtl > 0:
+        now = time.monotonic()
+        # Drop expired entries so old keys do not pile up
+        self.playerCache = {k:v for k, v in self.playerCache.items() if v[0] > now}
+        self.playerCache[key] = (now + self.playerTtl, data)
+      return data
+    finally:
+      del self.inFlight[key]
+
+
+  async def get_players(self, keys, concurrency=5, retries=2):
+    '''
+    Returns player data for each key, in the same order.
+    At most concurrency requests run at once, and players that
+    could not be fetched are returned as {}.
+    '''
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch(key):
+      async with semaphore:
+        return await self.get_player(key, retries)
+
+    return await asyncio.gather(*[fetch(key) for key in keys])
+
+
+  def get_cache_stats(self):
+    '''
+    Returns the player cache counters
+    '''
+    return {
+      "hits": self.cacheHits,
+      "coalesced": self.cacheCoalesced,
+      "misses": self.cacheMisses,
+      "size": len(self.playerCache)
+    }
+
+
+  async def get_market_prices(self, key):
+    '''
+    Returns the latest market prices from the API server
+    '''
+    return await self.get_json("market/history-latest/" + key, [])
+
+
+  async def close(self):
+    if self.session is not None and not self.session.closed:
+      await self.session.close()
@@ -0,0 +1,371 @@
+import numpy as np
+import calculator as calc
+from calculator import BATTLE_BOOSTS, PARTNER_BOOSTS, HOUSE_UPGRADES, LIVING_ROOM, CAVE_UPGRADES
+
+# Computes the >player investments and incomes of many players at once.
+# Player payloads are packed into arrays, so the work per partner, fighter,
+# boost and upgrade is done by numpy instead of Python loops.
+
+EQ_SLOTS = ["left_hand_level", "right_hand_level", "head_level", "body_level", "hands_level", "legs_level", "feet_level"]
+FIGHTER_STATS = ["health", "damage", "hit", "dodge", "defense", "crit_damage"]
+PET_FARMS = ["farm_strength", "farm_health", "farm_agility", "farm_dexterity"]
+HOMESTEADS = ["fishing_level", "mine_level", "logging_level", "farm_level"]
+
+# Indexed by partner action_id - 1
+RES_TYPES = ["meat", "iron", "wood", "stone"]
+PARTNER_SKILLS = ["hunting", "mining", "woodcutting", "stonecarving"]
+RES_STATS = ["strength", "health", "agility", "dexterity"]
+RES_HOUSE_UPGRADES = ["pitchfork", "fountain", "tools", "shed"]
+
+RESULT_FIELDS = [
+  "partnerCost", "partnerInvestment", "petCost", "petInvestment",
+  "fighterCost", "fighterInvestment", "eqSlotInvestment", "caveInvestment",
+  "relicBattleInvestment", "relicPartnerInvestment", "houseInvestment",
+  "homesteadInvestment", "totalInvestment", "goldPerDay", "resPerDay", "relicsPerDay"
+]
+# The >player total leaves out the pet farm investment, as the report always has
+TOTAL_FIELDS = [field for field in RESULT_FIELDS[:12] if field != "petInvestment"]
+RESULT_DTYPE = np.dtype([(field, np.float64) for field in RESULT_FIELDS])
+
+
+def consecutiveSum(n):
+  return n * (n + 1) / 2
+
+
+def getUnitInvestments(num):
+  '''
+  Vectorized getUnitInvestment, num is an array of unit counts
+  '''
+  num = np.maximum(num, 0)
+  return np.round((10.0**num - 1) / 9 * 10000)
+
+
+def getBracketInvestments(levels, table, size, nextIncrement):
+  '''
+  Vectorized calculator.getBracketInvestment for levels that
+  all fall inside the table's brackets
+  '''
+  if len(levels) == 0:
+    return np.zeros(0)
+  brackets = levels // size
+  calc.extendBracketTable(table, size, int(brackets.max()), nextIncrement)
+  investment, increment, initCost = (np.array(column, dtype=np.float64) for column in zip(*table[1:]))
+  i = brackets - table[0]
+  base = levels % size
+  return investment[i] + increment[i] * consecutiveSum(base) + initCost[i] * base
+
+
+def getRelicInvestments(levels):
+  '''
+  Vectorized calculator.getRelicInvestment
+  '''
+  levels = np.asarray(levels, dtype=np.int64)
+  result = np.zeros(levels.shape)
+  small = (levels > 0) & (levels <= 5000)
+  result[small] = 10 * consecutiveSum(levels[small])
+  mid = (levels > 5000) & (levels <= 10000)
+  result[mid] = getBracketInvestments(levels[mid], calc.relicTable5k, 1000, calc.nextRelicIncrement5k)
+  high = levels > 10000
+  result[high] = getBracketInvestments(levels[high], calc.relicTable10k, 1000, calc.nextRelicIncrement10k)
+  return result
+
+
+def getHomesteadInvestments(levels):
+  '''
+  Vectorized calculator.getHomesteadInvestment
+  '''
+  levels = np.asarray(levels, dtype=np.int64)
+  result = np.zeros(levels.shape)
+  low = (levels > 1) & (levels <= 1750)
+  result[low] = getBracketInvestments(levels[low], calc.homesteadTable, 250, calc.nextHomesteadIncrement)
+  high = levels > 1750
+  result[high] = getBracketInvestments(levels[high], calc.homesteadTable1750, 250, calc.nextHomesteadIncrement1750)
+  return result
+
+
+def getHouseInvestments(levels, base=1000):
+  '''
+  Vectorized calculator.getHouseInvestment
+  '''
+  levels = np.asarray(levels, dtype=np.int64)
+  result = np.zeros(levels.shape)
+  if levels.size == 0:
+    return result
+  calc.getHouseInvestment(int(levels.max()), base) #Fills in the table
+  table = np.array(calc.houseTables.get(base, [0]), dtype=np.float64)
+  inTable = (levels > 0) & (levels < len(table))
+  result[inTable] = table[levels[inTable]]
+  # Levels past the table limit are rare, use the scalar version
+  for index in zip(*np.nonzero(levels >= len(table))):
+    result[index] = calc.getHouseInvestment(int(levels[index]), base)
+  return result
+
+
+def getEqSlotInvestments(levels):
+  '''
+  Vectorized calculator.getEqSlotInvestment, levels is an
+  array of shape (players, slots)
+  '''
+  levels = np.asarray(levels, dtype=np.float64)
+  return np.where(levels > 0, 250 * ((1 - 1.1**levels) / -0.1), 0).sum(axis=1)
+
+
+def getBaseRes(stats):
+  '''
+  Vectorized calculator.getBaseRes
+  '''
+  stats = np.asarray(stats, dtype=np.int64)
+  chunks = np.maximum(stats - 1, 0) // 20000
+  calc.extendBaseResTable(int(chunks.max()) if stats.size else 0)
+  starts = np.array(calc.baseResStarts, dtype=np.float64)
+  multipliers = np.array(calc.baseResMultipliers, dtype=np.float64)
+  partial = stats - chunks * 20000
+  return np.where(stats > 0, starts[chunks] + partial / 100 * multipliers[chunks], 1)
+
+
+def getHouseBoosts(levels):
+  '''
+  Vectorized calculator.getHouseBoost
+  '''
+  levels = np.asarray(levels, dtype=np.int64)
+  steps = levels // 15
+  full = np.where(steps <= 10, 15 * steps * (steps + 1) // 2, 825 + 150 * (steps - 10))
+  return (full + (levels % 15) * np.minimum(steps, 10)) / 100
+
+
+def getFrenzyMultipliers(frenzy):
+  '''
+  Vectorized calculator.getFrenzyMultiplier
+  '''
+  frenzy = np.asarray(frenzy, dtype=np.float64)
+  kills = np.floor(frenzy)
+  series = 0.65 * (1 - 0.65**kills) / 0.35 / 1.3 + 0.02 * kills
+  remainder = (frenzy % 1) * (0.65**(kills + 1) / 1.3 + 0.02)
+  return 1 + series + remainder
+
+
+def getPlayerBoosts(data, income):
+  '''
+  Returns the boosts of an income type (gold, resource or drop)
+  that do not depend on the partner or res type:
+  exploration, kingdom tile, village boost tile, building, village tile, party
+  '''
+  buildings = {"gold": "market", "resource": "mill", "drop": "well"}
+  if "kingdom" in data and "explorationBoosts" in data["kingdom"]:
+    kingdom = data["kingdom"]
+    exploration = kingdom["explorationBoosts"][income] / 100
+    kingdomTile = calc.getTileBoost(kingdom["tiles"], income) + calc.getMysteryTileBoost(kingdom, income)
+    villageBoostTile = calc.getTileBoost(kingdom["tiles"], "village")
+  else:
+    exploration = 0
+    kingdomTile = 0
+    villageBoostTile = 0
+
+  if "village" in data and "boosts" in data["village"]:
+    building = calc.getBuildingBoost(data["village"]["boosts"][buildings[income]])
+    villageTile = calc.getTileBoost(data["village"]["tiles"], income)
+  else:
+    building = 0
+    villageTile = 0
+
+  if "partyPvPData" in data and income in data["partyPvPData"]:
+    party = data["partyPvPData"][income] / 100
+  else:
+    party = 0
+  return exploration, kingdomTile, villageBoostTile, building, villageTile, party
+
+
+class PlayerBatch:
+  '''
+  The fields of N player payloads packed into arrays.
+  Per-player values have shape (N, ...). Partners and fighters
+  of all players are flattened, with an owner index per row.
+  '''
+  def __init__(self, players):
+    self.size = len(players)
+    self.players = players
+    currency = [data["currency"] for data in players]
+
+    self.partnerOwner = np.array([i for i, data in enumerate(players) for _ in data["partners"]], dtype=np.int64)
+    partners = [partner for data in players for partner in data["partners"]]
+    self.partnerSpeed = np.array([p["speed"] for p in partners], dtype=np.float64)
+    self.partnerIntelligence = np.array([p["intelligence"] for p in partners], dtype=np.float64)
+    self.partnerRes = np.array([p["action_id"] - 1 for p in partners], dtype=np.int64)
+    self.partnerLevel = np.array([p[PARTNER_SKILLS[p["action_id"] - 1]] for p in partners], dtype=np.float64)
+    self.partnerStat = np.array([p[RES_STATS[p["action_id"] - 1]] for p in partners], dtype=np.float64)
+    self.partnerCount = np.bincount(self.partnerOwner, minlength=self.size)
+
+    self.fighterOwner = np.array([i for i, data in enumerate(players) for _ in data["fighters"]], dtype=np.int64)
+    self.fighterStats = np.array(
+      [[f[stat] for stat in FIGHTER_STATS] for data in players for f in data["fighters"]],
+      dtype=np.float64).reshape(-1, len(FIGHTER_STATS))
+    self.fighterCount = np.bincount(self.fighterOwner, minlength=self.size)
+
+    self.petCount = np.array([len(data["pets"]) for data in players])
+    self.petFarms = self.pack([[data["playerPetsData"][farm] for farm in PET_FARMS] for data in players], PET_FARMS)
+    self.eqSlots = self.pack([[data["equipmentSlots"][slot] for slot in EQ_SLOTS] for data in players], EQ_SLOTS)
+    self.cave = self.pack([[data["fighterCaveTools"][tool] for tool in CAVE_UPGRADES] for data in players], CAVE_UPGRADES)
+    self.battleBoosts = self.pack([[data["boosts"][b] for b in BATTLE_BOOSTS] for data in players], BATTLE_BOOSTS)
+    self.partnerBoosts = self.pack([[data["boosts"][b] for b in PARTNER_BOOSTS] for data in players], PARTNER_BOOSTS)
+    self.house = self.pack([[data["house"][deco] for deco in HOUSE_UPGRADES] for data in players], HOUSE_UPGRADES)
+    self.livingRoom = self.pack([[data["house"][deco] for deco in LIVING_ROOM] for data in players], LIVING_ROOM)
+    self.resHouse = self.pack([[data["house"][deco] for deco in RES_HOUSE_UPGRADES] for data in players], RES_HOUSE_UPGRADES)
+    self.homesteads = self.pack([[data["playerHomesteadData"][hs] for hs in HOMESTEADS] for data in players], HOMESTEADS)
+    self.plots = np.array([data["playerHomesteadData"]["plots"] for data in players], dtype=np.int64)
+    self.stats = self.pack([[data["stats"][stat] for stat in RES_STATS] for data in players], RES_STATS).astype(np.float64)
+
+    self.shatteredPartnerGold = np.array([c["shattered_partner_gold"] for c in currency], dtype=np.float64)
+    self.shatteredFighterGold = np.array([c["shattered_fighter_gold"] for c in currency], dtype=np.float64)
+    self.shatteredBattlingRelics = np.array([c["shattered_battling_relics"] for c in currency], dtype=np.float64)
+    self.shatteredPartnerRelics = np.array([c["shattered_partner_relics"] for c in currency], dtype=np.float64)
+
+    self.battling = np.array([data["skills"]["battling"] for data in players], dtype=np.float64)
+    self.monster = np.array([data["actions"]["monster_id"] for data in players], dtype=np.int64)
+    self.dungeon = np.array([data["playerFighterData"]["dungeon_level"] for data in players], dtype=np.float64)
+    self.vip = np.array([0.1 if calc.hasVip(data["player"]["vip_time"]) else 0 for data in players])
+    self.frenzy = np.array([calc.getGemBoost(data["equipmentEquipped"], "frenzy") for data in players])
+    self.enchants = {
+      enchant: np.array([calc.getEnchantBoost(data["equipmentEquipped"], enchant) for data in players])
+      for enchant in ["gold", "drop"] + RES_TYPES
+    }
+    self.explorationPenalty = np.array([
+      data["kingdom"]["activeExploration"]["cost"] / 100
+      if "kingdom" in data and "explorationBoosts" in data["kingdom"] else 0
+      for data in players
+    ])
+    self.boosts = {
+      income: np.array([getPlayerBoosts(data, income) for data in players], dtype=np.float64).reshape(-1, 6)
+      for income in ["gold", "resource", "drop"]
+    }
+
+
+  def pack(self, rows, columns):
+    return np.array(rows, dtype=np.int64).reshape(-1, len(columns))
+
+
+  def get_pvp(self, income):
+    '''
+    Returns the pvp boost of each player for the income type
+    '''
+    exploration, kingdomTile, villageBoostTile, building, villageTile, party = self.boosts[income].T
+    return party + villageTile + kingdomTile + ((1 + villageBoostTile) * building - building)
+
+
+  def get_investments(self, prices):
+    '''
+    Returns a dict of investment arrays, matching the values in
+    the >player report
+    '''
+    matPrice = float(prices["meat"]) + float(prices["iron"]) + float(prices["wood"]) + float(prices["stone"])
+    relicPrice = float(prices["relics"])
+    diamondPrice = float(prices["diamonds"])
+    result = {}
+
+    partnerUpgrades = np.round(10000 * consecutiveSum(self.partnerSpeed)) + \
+      np.round(10000 * consecutiveSum(self.partnerIntelligence))
+    result["partnerInvestment"] = self.shatteredPartnerGold + \
+      np.bincount(self.partnerOwner, weights=partnerUpgrades, minlength=self.size)
+    result["partnerCost"] = getUnitInvestments(self.partnerCount)
+
+    result["petCost"] = getUnitInvestments(self.petCount)
+    result["petInvestment"] = consecutiveSum(self.petFarms).sum(axis=1) * 50000
+
+    fighterUpgrades = np.round(10000 * consecutiveSum(self.fighterStats)).sum(axis=1)
+    result["fighterInvestment"] = self.shatteredFighterGold + \
+      np.bincount(self.fighterOwner, weights=fighterUpgrades, minlength=self.size)
+    result["fighterCost"] = getUnitInvestments(self.fighterCount - 1)
+
+    result["eqSlotInvestment"] = getEqSlotInvestments(self.eqSlots) * matPrice
+
+    caveLevels = consecutiveSum(self.cave)
+    result["caveInvestment"] = np.round(caveLevels * 4000 * matPrice + caveLevels * diamondPrice).sum(axis=1)
+
+    result["relicBattleInvestment"] = self.shatteredBattlingRelics * relicPrice + \
+      np.round(getRelicInvestments(self.battleBoosts) * relicPrice).sum(axis=1)
+    result["relicPartnerInvestment"] = self.shatteredPartnerRelics * relicPrice + \
+      np.round(getRelicInvestments(self.partnerBoosts) * relicPrice).sum(axis=1)
+
+    result["houseInvestment"] = (getHouseInvestments(self.house).sum(axis=1) + \
+      getHouseInvestments(self.livingRoom, 5000000).sum(axis=1)) * matPrice
+
+    resPrices = np.array([float(prices[res]) for res in RES_TYPES])
+    plots = np.where(self.plots > 1, 2500 * 10.0**self.plots, 0)
+    result["homesteadInvestment"] = (getHomesteadInvestments(self.homesteads) * resPrices).sum(axis=1) + \
+      plots * matPrice
+
+    result["totalInvestment"] = sum(result[field] for field in TOTAL_FIELDS)
+    return result
+
+
+  def get_gold_income(self):
+    '''
+    Vectorized calculator.getPersonalGoldIncome, in gold per action
+    '''
+    exploration, kingdomTile, villageBoostTile, building, villageTile, party = self.boosts["gold"].T
+    pve = self.battling * 0.00015 + self.enchants["gold"] + exploration + building
+    pvp = self.get_pvp("gold")
+    regular = np.round((8 + 2 * self.monster) * (1 + pve) * (1 + pvp) * (1 + self.vip))
+    return np.round(regular * getFrenzyMultipliers(self.frenzy))
+
+
+  def get_res_income(self):
+    '''
+    Vectorized calculator.getPartnerResIncomeHr
+    '''
+    exploration, kingdomTile, villageBoostTile, building, villageTile, party = self.boosts["resource"].T
+    pve = exploration + building
+    pvp = self.get_pvp("resource")
+    owner, res = self.partnerOwner, self.partnerRes
+
+    houseBoosts = getHouseBoosts(self.resHouse)
+    relicBoosts = self.partnerBoosts * 0.00025
+    enchants = np.stack([self.enchants[resType] for resType in RES_TYPES], axis=1)
+
+    speed = 18 / (0.1 + self.partnerSpeed / (self.partnerSpeed + 2500))
+    intelligence = self.partnerIntelligence
+    totalStat = np.round(((20 + (intelligence / (intelligence + 250)) * 100) / 100) * \
+      self.stats[owner, res] + self.partnerStat)
+
+    partnerPve = pve[owner] + self.partnerLevel / 10000 + enchants[owner, res] + \
+      houseBoosts[owner, res] + relicBoosts[owner, res]
+    totalBoost = (1 + partnerPve) * (1 + pvp[owner]) * (1 + self.vip[owner])
+    resPerHarvest = np.round(getBaseRes(totalStat) * totalBoost * (1 - self.explorationPenalty[owner]))
+    income = np.round(resPerHarvest * (3600 / speed))
+    return np.bincount(owner, weights=income, minlength=self.size)
+
+
+  def get_relic_income(self):
+    '''
+    Vectorized calculator.getRelicIncomeHr
+    '''
+    exploration, kingdomTile, villageBoostTile, building, villageTile, party = self.boosts["drop"].T
+    area = self.monster // 100 * 0.05
+    pve = area + building + exploration + self.enchants["drop"]
+    pvp = self.get_pvp("drop")
+    dungeon = 1 + 0.02 * self.dungeon
+
+    dropAmount = 225 * dungeon * (1 + self.battling / 10000 * 1.5)
+    income = np.round(600 * (0.01 * (1 + pve) * (1 + pvp)) * dropAmount)
+
+    # Partners do not use player area
+    owner = self.partnerOwner
+    speed = 18 / (0.1 + self.partnerSpeed / (self.partnerSpeed + 2500))
+    dropAmount = 225 * dungeon[owner] * (1 + self.partnerLevel / 10000)
+    dropChance = 0.03 * (1 + pve[owner] - area[owner]) * (1 + pvp[owner])
+    partnerIncome = np.round(dropAmount * dropChance * (3600 / speed))
+    return income + np.bincount(owner, weights=partnerIncome, minlength=self.size)
+
+
+def getBatchResults(players, prices):
+  '''
+  Returns a structured array with one row of investments and daily
+  incomes per player payload. Fields are listed in RESULT_FIELDS.
+  '''
+  batch = PlayerBatch(players)
+  result = np.zeros(batch.size, dtype=RESULT_DTYPE)
+  for field, values in batch.get_investments(prices).items():
+    result[field] = values
+  result["goldPerDay"] = batch.get_gold_income() * 14400
+  result["resPerDay"] = batch.get_res_income() * 24
+  result["relicsPerDay"] = batch.get_relic_income() * 24
+  return result
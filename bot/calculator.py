@@ -1,4 +1,14 @@
-from datetime import datetime
+from timestamps import is_future
+from functools import lru_cache
+
+HELPER_CACHE_SIZE = 4096
+
+# Boosts and upgrades that are summed into the >player investments
+BATTLE_BOOSTS = ["critChance", "critDamage", "multistrike", "healing", "defense"]
+PARTNER_BOOSTS = ["hunting_boost", "mining_boost", "woodcutting_boost", "stonecarving_boost"]
+HOUSE_UPGRADES = ["chairs", "stove", "sink", "basket", "pitchfork", "shed", "fountain", "tools", "barrel"]
+LIVING_ROOM = ["table", "candlestick", "carpet", "couch"]
+CAVE_UPGRADES = ["archeology", "brush", "trowel", "map", "backpack", "torch", "scouting", "spade", "knife", "compass"]
 
 def getUnitInvestment(num):
   '''
@@ -15,6 +25,46 @@ def getPlotInvestment(num):
   return 0 if num <= 1 else int("2500" + "0" * num)
 
 
+def extendBracketTable(table, size, last, nextIncrement):
+  '''
+  Appends brackets to the table until it reaches the bracket index last.
+  A table is [first bracket index, (investment, increment, initCost), ...],
+  with the values at the start of each bracket of size levels.
+  '''
+  first = table[0]
+  investment, increment, initCost = table[-1]
+  for i in range(first + len(table) - 2, last):
+    investment += increment * (size * (size + 1) / 2) + (initCost * size)
+    initCost += increment * size
+    increment = nextIncrement(i, increment)
+    table.append((investment, increment, initCost))
+
+
+def getBracketInvestment(table, size, level, nextIncrement):
+  '''
+  Returns the investment at the level, from the start of its bracket
+  plus the levels bought inside the bracket
+  '''
+  i = level // size
+  if i - table[0] + 1 >= len(table):
+    extendBracketTable(table, size, i, nextIncrement)
+  investment, increment, initCost = table[i - table[0] + 1]
+  base = level % size
+  return investment + increment * (base * (base + 1) / 2) + (initCost * base)
+
+
+# Relic costs change every 1k levels
+relicTable5k = [5, (125025000, 30, 50000)] #Investment at level 5000
+relicTable10k = [10, (1050200000, 130, 400000)] #Investment at level 10,000
+
+def nextRelicIncrement5k(i, increment):
+  return increment + 20 #increases every 1k levels
+
+def nextRelicIncrement10k(i, increment):
+  #Past 10k, increment also starts to add in consecutive sums (n * (n+1) / 2)
+  return (i - 7) * (i - 6) / 2 * 10 + 100
+
+
 def getRelicInvestment(level):
   '''
   Returns the amount of relics invested according to the level
@@ -25,30 +75,28 @@ def getRelicInvestment(level):
   if level <= 5000:
     return 10 * (level * (level + 1) / 2)
   elif level <= 10000:
-    investment = 125025000 #Investment at level 5000
-    increment = 30
-    initCost = 50000
-    
-    for i in range(5, level//1000 + 1):
-      base = 1000 if level >= (i+1) * 1000 else level % (i * 1000)
-      investment += increment * (base * (base + 1) / 2) + (initCost * base)
-      initCost += increment * 1000
-      increment += 20 #increases every 1k levels
-      
+    return getBracketInvestment(relicTable5k, 1000, level, nextRelicIncrement5k)
   else: #level > 10k
-    investment = 1050200000 #Investment at level 10,000
-    increment = 130
-    initCost = 400000
-    
-    for i in range(10, level // 1000 + 1):
-      base = 1000 if level >= (i+1) * 1000 else level % (i * 1000)
-      investment += increment * (base * (base + 1) / 2) + (initCost * base)
-      initCost += increment * 1000
-      #Past 10k, increment also starts to add in consecutive sums (n * (n+1) / 2)
-      increment = (i - 7) * (i - 6) / 2 * 10 + 100
-      
-  return investment
+    return getBracketInvestment(relicTable10k, 1000, level, nextRelicIncrement10k)
+
 
+def getRelicInvestments(levels):
+  '''
+  Returns the amount of relics invested for each level in the list
+  '''
+  return [getRelicInvestment(level) for level in levels]
+
+
+# Homestead costs change every 250 levels
+homesteadTable = [0, (-1000, 1000, 0)] #To account for not upgrading the 1st level
+homesteadTable1750 = [7, (4378499000, 8010, 7000000)] #Investment at level 1750
+
+def nextHomesteadIncrement(i, increment):
+  return increment + 1000 #increases by 1000 every 250 levels
+
+def nextHomesteadIncrement1750(i, increment):
+  #Past 1750, increment also starts to add in consecutive sums (n * (n+1) / 2)
+  return (i - 5) * (i - 4) / 2 * 10 + (i + 2) * 1000
 
 
 def getHomesteadInvestment(level):
@@ -59,30 +107,16 @@ def getHomesteadInvestment(level):
     return 0
 
   if level <= 1750:
-    investment = -1000 #To account for not upgrading the 1st level
-    increment = 1000
-    initCost = 0
-    
-    for i in range(level // 250 + 1):
-      base = 250 if level >= (i + 1) * 250 else level % 250
-      investment += increment * (base * (base + 1) / 2) + (initCost * base)
-      initCost += increment * 250
-      increment += 1000 #increases by 1000 every 250 levels
-      
+    return getBracketInvestment(homesteadTable, 250, level, nextHomesteadIncrement)
   else: #level > 1750
-    investment = 4378499000 #Investment at level 1750
-    increment = 8010
-    initCost = 7000000
-    
-    for i in range(7, level // 250 + 1):
-      base = 250 if level >= (i + 1) * 250 else level % 250
-      investment += increment * (base * (base + 1) / 2) + (initCost * base)
-      initCost += increment * 250
-      #Past 1750, increment also starts to add in consecutive sums (n * (n+1) / 2)
-      increment = (i - 5) * (i - 4) / 2 * 10 + (i + 2) * 1000
-      
+    return getBracketInvestment(homesteadTable1750, 250, level, nextHomesteadIncrement1750)
 
-  return investment
+
+def getHomesteadInvestments(levels):
+  '''
+  Returns the amount of res invested into homestead for each level in the list
+  '''
+  return [getHomesteadInvestment(level) for level in levels]
 
 
 def getPartnerInvestment(speed, intelligence):
@@ -138,17 +172,40 @@ def getEqSlotInvestment(eqSlotLevels):
   return investment
 
 
+HOUSE_TABLE_LIMIT = 20000
+houseTables = {} #base -> cumulative investment at each level
+
+def extendHouseTable(table, base, level):
+  '''
+  Appends the cumulative house investment of every level up to
+  the given level to the table
+  '''
+  investment = table[-1]
+  # Couldn't find a closed formula
+  for i in range(len(table), level + 1):
+    investment += base + (base * (i - 1)**1.25)
+    table.append(investment)
+
+
 def getHouseInvestment(level, base=1000):
   '''
   Returns the amount of a single type of res used in house upgrades,
   given the level. For a complete amount, multiply the return value
   by 4.
+  Levels are looked up in a cumulative table for the base, which is
+  filled in up to HOUSE_TABLE_LIMIT as higher levels are requested.
   '''
   if level <= 0: return 0
-  investment = 0
+  table = houseTables.setdefault(base, [0])
 
-  # Couldn't find a closed formula
-  for i in range(1, level + 1):
+  if level >= len(table) and len(table) <= HOUSE_TABLE_LIMIT:
+    extendHouseTable(table, base, min(level, HOUSE_TABLE_LIMIT))
+  if level < len(table):
+    return table[level]
+
+  # Past the table, continue the sum from its last level
+  investment = table[-1]
+  for i in range(len(table), level + 1):
     investment += base + (base * (i - 1)**1.25)
   return investment
 
@@ -160,6 +217,7 @@ def getCaveInvestment(level, resPrice, diamondPrice):
   diamondInvestment = level * (level + 1) / 2 * float(diamondPrice)
   return round(level * (level + 1) / 2 * 4000 * resPrice + diamondInvestment)
 
+@lru_cache(maxsize=HELPER_CACHE_SIZE)
 def getBuildingBoost(level):
   '''
   Gets the boost according to the village building's level
@@ -201,7 +259,7 @@ def getGemBoost(equipped, boostType):
     if gear.get("gem_type", "") == boostType:
       boost += gear["gem_value"]
     elif gear.get("gem_splinter_type", "") == boostType: #Cannot have same type on gem and splinter
-      if datetime.utcnow() < datetime.strptime(gear["gem_splinter_time"], "%Y-%m-%dT%H:%M:%S.000Z"):
+      if is_future(gear["gem_splinter_time"]):
         multiplier = 0.4
       else:
         multiplier = 0.2
@@ -215,8 +273,7 @@ def hasVip(expiryDate):
   '''
   Return True if vip is active
   '''
-  return expiryDate != '0000-00-00 00:00:00' and \
-    datetime.utcnow() < datetime.strptime(expiryDate, "%Y-%m-%dT%H:%M:%S.000Z")
+  return is_future(expiryDate)
 
 
 def getEnchantBoost(equipment, enchantType):
@@ -231,8 +288,25 @@ def getEnchantBoost(equipment, enchantType):
   return boost / 100
 
 
-def getPersonalGoldIncome(data, enchantment):
-  # Current mob, Level, Enchant, Exploration, Building, Party, V-Tile, KD-Tile, village boost tile, VIP, Frenzy
+def getFrenzyMultiplier(frenzy):
+  '''
+  Returns the gold multiplier from frenzy. Every whole frenzy %
+  adds a kill worth (0.65**k) / 1.3 + 0.02 of the gold, and the
+  remaining fraction is the chance of one more kill.
+  '''
+  numKills = int(frenzy)
+  # Geometric series closed form of 0.65**1 + ... + 0.65**numKills
+  series = 0.65 * (1 - 0.65**numKills) / 0.35
+  multiplier = 1 + series / 1.3 + 0.02 * numKills
+  # Remaining % of frenzy (chance)
+  return multiplier + (frenzy % 1) * ((0.65**(numKills + 1)) / 1.3 + 0.02)
+
+
+def getRegularGoldPerAction(data, enchantment):
+  '''
+  Returns the gold per action before frenzy is applied
+  '''
+  # Current mob, Level, Enchant, Exploration, Building, Party, V-Tile, KD-Tile, village boost tile, VIP
   monster = data["actions"]["monster_id"]
   level = data["skills"]["battling"] * 0.00015
 
@@ -260,33 +334,42 @@ def getPersonalGoldIncome(data, enchantment):
   vipExpiryDate = data["player"]["vip_time"]
   vip = 0.1 if hasVip(vipExpiryDate) else 0
   
-  frenzy = getGemBoost(data["equipmentEquipped"], "frenzy")
   pve = level + enchantment + exploration + building
   pvp = party + villageTile + kingdomTile + ((1 + villageBoostTile) * building - building)
-  regularGoldPerAction = round((8 + 2 * monster) * (1 + pve) * (1 + pvp) * (1 + vip))
-  frenzyGoldPerAction = regularGoldPerAction
-  
-  numKills = 1
-  for _ in range(1, int(frenzy) + 1):
-    frenzyGoldPerAction += regularGoldPerAction * ((0.65**numKills) / 1.3 + 0.02)
-    numKills += 1
-  # Remaining % of frenzy (chance)
-  frenzyGoldPerAction += regularGoldPerAction * (frenzy % 1) * ((0.65**(numKills)) / 1.3 + 0.02)
-  return round(frenzyGoldPerAction)
+  return round((8 + 2 * monster) * (1 + pve) * (1 + pvp) * (1 + vip))
+
+
+def getPersonalGoldIncome(data, enchantment):
+  '''
+  Returns the gold per action, including frenzy from the equipped gems
+  '''
+  frenzy = getGemBoost(data["equipmentEquipped"], "frenzy")
+  return round(getRegularGoldPerAction(data, enchantment) * getFrenzyMultiplier(frenzy))
+
+
+def getPersonalGoldIncomes(data, enchantment, frenzyValues):
+  '''
+  Returns the gold per action for each frenzy value in the list,
+  in place of the player's current frenzy. Useful for what-ifs.
+  '''
+  regularGoldPerAction = getRegularGoldPerAction(data, enchantment)
+  return [round(regularGoldPerAction * getFrenzyMultiplier(frenzy)) for frenzy in frenzyValues]
 
 
+@lru_cache(maxsize=HELPER_CACHE_SIZE)
 def getHouseBoost(level):
   '''
   Returns the house boost corresponding to the level
   '''
   if level == 0: return 0
 
-  boost = 0
-  multiplier = 0
-  for _ in range(1, int(level / 15) + 1):
-    multiplier += 1
-    boost += min(multiplier * 15, 150)
-  boost += (level % 15) * min(multiplier, 10)
+  # Every 15 levels the boost per level goes up by 15%, up to 150% after 10 steps
+  steps = int(level / 15)
+  if steps <= 10:
+    boost = 15 * steps * (steps + 1) // 2
+  else:
+    boost = 825 + 150 * (steps - 10)
+  boost += (level % 15) * min(steps, 10)
   return boost / 100
 
 
@@ -304,19 +387,42 @@ def getPartnerLevel(partner, resType):
     return partner["stonecarving"]
 
 
+baseResStarts = [1] #Base res at the start of each 20000 stat chunk
+baseResMultipliers = [3] #Multiplier of each chunk
+
+def extendBaseResTable(chunk):
+  '''
+  Fills in the base res table up to the given chunk
+  '''
+  while len(baseResMultipliers) <= chunk:
+    multiplier = baseResMultipliers[-1]
+    baseResStarts.append(baseResStarts[-1] + 20000 / 100 * multiplier)
+    if multiplier > 0.3:
+      multiplier -= 0.05 if multiplier > 1.8 else 0.1
+    baseResMultipliers.append(multiplier)
+
+
 def getBaseRes(stat):
   '''
   Returns the base res, which is calculated from the stat.
+  Every 20000 stat gives less res than the last, so the res at the
+  start of each chunk is kept in a table.
   '''
-  baseRes = 1
-  multiplier = 3
+  if stat <= 0: return 1
+
+  chunk = (stat - 1) // 20000
+  extendBaseResTable(chunk)
+  return baseResStarts[chunk] + (stat - chunk * 20000) / 100 * baseResMultipliers[chunk]
 
-  for tempStat in range(stat, 0, -20000):
-    baseRes += min(tempStat, 20000) / 100 * multiplier
-    if multiplier > 0.3:
-      multiplier -= 0.05 if multiplier > 1.8 else 0.1
 
-  return baseRes
+def getCacheStats():
+  '''
+  Returns the hits, misses and size of each memoized helper
+  '''
+  return {
+    helper.__name__: helper.cache_info()._asdict()
+    for helper in [getHouseBoost, getBuildingBoost]
+  }
 
 
 def getPartnerResIncomeHr(data):
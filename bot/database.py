@@ -1,42 +1,225 @@
 # Manage database operations here
-import redis
+import redis.asyncio as aioredis
+import asyncio
 import os
 import json
+import metrics
 
 # Connect to database
-redis = redis.Redis(
+# All connections come from one shared pool, so commands never block the event loop
+pool = aioredis.ConnectionPool(
   host=os.getenv("REDIS_HOSTNAME"),
   port=os.getenv("REDIS_PORT"),
   password=os.getenv("REDIS_PASSWORD"),
+  max_connections=int(os.getenv("REDIS_MAX_CONNECTIONS", 10)),
   decode_responses=True
 )
+redis = aioredis.Redis(connection_pool=pool)
+
+# Every key is stored under this prefix, so the bot can share a Redis database
+PREFIX = os.getenv("REDIS_KEY_PREFIX", "qsbot:")
+# Keys that were stored without a prefix by older versions of the bot
+LEGACY_KEYS = ["tiles", "mystery", "exploration_timer", "last_updated", "channelId", "prices", "market_last_updated"]
+SCAN_BATCH = 500
+
+def _key(key):
+  return PREFIX + key
+
+def _decode(result):
+  try:
+    return json.loads(result)
+  except:
+    return result
 
 # Store
-def db_set(key, value):
-  redis.set(key, json.dumps(value))
+@metrics.redisSeconds.timed(operation="set")
+async def db_set(key, value):
+  await redis.set(_key(key), json.dumps(value))
 
 # Retrieval
-def db_get(key, default=None):
-  result = redis.get(key)
+@metrics.redisSeconds.timed(operation="get")
+async def db_get(key, default=None):
+  result = await redis.get(_key(key))
   if result is None:
     return default
   else:
-    try:
-      obj = json.loads(result)
-      return obj
-    except:
-      return result
+    return _decode(result)
 
 # Get all key/value pairs
-def db_get_all():
-  keys = redis.keys()
-  values = redis.mget(keys)
-  return {keys[i]:json.loads(values[i]) for i in range(len(keys))}
+async def db_iter_all():
+  '''
+  Yields all of the bot's key/value pairs. Keys are found with SCAN
+  and read with one MGET per batch, so Redis is never blocked.
+  '''
+  batch = []
+  async for key in redis.scan_iter(match=PREFIX + "*", count=SCAN_BATCH):
+    batch.append(key)
+    if len(batch) >= SCAN_BATCH:
+      for pair in await _get_batch(batch):
+        yield pair
+      batch = []
+  if batch:
+    for pair in await _get_batch(batch):
+      yield pair
+
+async def _get_batch(keys):
+  values = await redis.mget(keys)
+  # A key may have been deleted between the SCAN and the MGET
+  return [(keys[i][len(PREFIX):], _decode(values[i])) for i in range(len(keys)) if values[i] is not None]
+
+@metrics.redisSeconds.timed(operation="get_all")
+async def db_get_all():
+  result = {key:value async for key, value in db_iter_all()}
+  if not result and PREFIX:
+    result = await _migrate_legacy()
+  return result
+
+async def _migrate_legacy():
+  '''
+  Copies keys saved before the prefix existed under the prefix.
+  '''
+  values = await redis.mget(LEGACY_KEYS)
+  result = {LEGACY_KEYS[i]:_decode(values[i]) for i in range(len(LEGACY_KEYS)) if values[i] is not None}
+  if result:
+    print("Migrating {} keys to the {} prefix".format(len(result), PREFIX))
+    await db_set_all(result)
+  return result
+
+@metrics.redisSeconds.timed(operation="set_all")
+async def db_set_all(dict):
+  jsonDict = {_key(key):json.dumps(dict[key]) for key in dict.keys()}
+  await redis.mset(jsonDict)
+
+@metrics.redisSeconds.timed(operation="write")
+async def db_write(dict, deleted=()):
+  '''
+  Stores and deletes keys in a single pipelined round trip
+  '''
+  pipe = redis.pipeline(transaction=False)
+  if dict:
+    pipe.mset({_key(key):json.dumps(dict[key]) for key in dict.keys()})
+  if deleted:
+    pipe.delete(*[_key(key) for key in deleted])
+  await pipe.execute()
+
+# Hashes
+@metrics.redisSeconds.timed(operation="hgetall")
+async def db_hgetall(name):
+  result = await redis.hgetall(_key(name))
+  return {field:_decode(value) for field, value in result.items()}
 
-def db_set_all(dict):
-  jsonDict = {key:json.dumps(dict[key]) for key in dict.keys()}
-  redis.mset(jsonDict)
+@metrics.redisSeconds.timed(operation="hwrite")
+async def db_hwrite(name, dict, deleted=()):
+  '''
+  Stores and deletes fields of a hash in a single pipelined round trip
+  '''
+  pipe = redis.pipeline(transaction=False)
+  if dict:
+    pipe.hset(_key(name), mapping={field:json.dumps(dict[field]) for field in dict.keys()})
+  if deleted:
+    pipe.hdel(_key(name), *deleted)
+  await pipe.execute()
 
 # Deletion
-def db_del(key):
-  redis.delete(key)
\ No newline at end of file
+@metrics.redisSeconds.timed(operation="del")
+async def db_del(key):
+  await redis.delete(_key(key))
+
+# Shutdown
+async def db_close():
+  await pool.disconnect()
+
+
+class TrackedStore(dict):
+  '''
+  An in-memory mirror of the database that remembers which keys
+  were modified, so only those keys are written back on a flush.
+  Values that are mutated in place must be marked with mark_dirty.
+  '''
+  def __init__(self, *args, **kwargs):
+    super().__init__(*args, **kwargs)
+    self.dirty = set()
+    self.flushTask = None
+
+
+  def __setitem__(self, key, value):
+    super().__setitem__(key, value)
+    self.dirty.add(key)
+
+
+  def __delitem__(self, key):
+    super().__delitem__(key)
+    self.dirty.add(key)
+
+
+  def update(self, *args, **kwargs):
+    for key, value in dict(*args, **kwargs).items():
+      self[key] = value
+
+
+  def setdefault(self, key, default=None):
+    if key not in self:
+      self[key] = default
+    return self[key]
+
+
+  def __ior__(self, other):
+    self.update(other)
+    return self
+
+
+  def pop(self, key, *default):
+    if key in self:
+      self.dirty.add(key)
+    return super().pop(key, *default)
+
+
+  def popitem(self):
+    key, value = super().popitem()
+    self.dirty.add(key)
+    return key, value
+
+
+  def clear(self):
+    self.dirty |= self.keys()
+    super().clear()
+
+
+  def mark_dirty(self, key):
+    self.dirty.add(key)
+
+
+  async def flush(self):
+    '''
+    Writes all modified keys to the database in one pipelined write.
+    Returns the number of keys that were written.
+    '''
+    if not self.dirty: return 0
+
+    keys, self.dirty = self.dirty, set()
+    try:
+      await db_write(
+        {key:self[key] for key in keys if key in self},
+        [key for key in keys if key not in self]
+      )
+    except Exception:
+      self.dirty |= keys #Try again on the next flush
+      raise
+    return len(keys)
+
+
+  def flush_later(self, delay=5):
+    '''
+    Schedules a flush in delay seconds. Changes made before then
+    are written together in the same flush.
+    '''
+    if self.flushTask is None or self.flushTask.done():
+      self.flushTask = asyncio.ensure_future(self._flush_after(delay))
+
+
+  async def _flush_after(self, delay):
+    await asyncio.sleep(delay)
+    try:
+      await self.flush()
+    except Exception as e: #The keys stay dirty for the next flush
+      print("Failed to save to the database: {}".format(repr(e)))
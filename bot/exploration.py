@@ -1,10 +1,10 @@
 from datetime import datetime
 from datetime import timedelta
+from timestamps import parse_timestamp
 
 class Exploration:
   def __init__(self, endTime):
-    self.end = datetime.strptime(endTime, "%Y-%m-%dT%H:%M:%S.000Z")
-    self.reminderInterval = 40
+    self.end = parse_timestamp(endTime)
 
   def get_end_time(self):
     '''
@@ -15,16 +15,12 @@ class Exploration:
     '''
     return self.end
 
-  def get_reminder_time(self):
+  def get_reminder_time(self, minutes):
     '''
     Returns a datetime format of the end of the exploration timer,
-    but 40 minutes earlier than the end time.
+    but the given minutes earlier than the end time.
     '''
-    return self.end - timedelta(minutes=self.reminderInterval)
-
-
-  def get_reminder_interval(self):
-    return self.reminderInterval
+    return self.end - timedelta(minutes=minutes)
 
   def get_time_remaining(self):
     '''
@@ -0,0 +1,83 @@
+import os
+import json
+from tile import load_tiles
+from exploration import Exploration
+from poller import AdaptivePoller
+
+# Fields that older versions of the bot stored without a kingdom
+LEGACY_FIELDS = ["tiles", "mystery", "exploration_timer", "last_updated", "channelId"]
+
+class Kingdom:
+  '''
+  The monitored state of one kingdom: its tiles, mystery tile,
+  exploration and notification channel. It is saved in the
+  database under kingdom:<name>:<field> keys.
+  '''
+  def __init__(self, name, key, channelId):
+    self.name = name
+    self.key = key #API key of a player in the kingdom
+    self.channelId = channelId
+    self.channel = None #Found from channelId once the bot is ready
+
+    self.tiles = []
+    self.mystery = "???"
+    self.exploration = Exploration("2000-01-01T00:00:00.000Z")
+    self.timerStopped = False
+    self.tilesVersion = 0 #Changes whenever the tiles or mystery do
+    self.tilesEmbed = None #(cache key, embed) of the last >tiles
+
+    self.fingerprint = None #Of the last kingdom data that was processed
+    self.lastChecked = None #Time of the last update, even if nothing changed
+    self.skippedUpdates = 0
+    self.poller = AdaptivePoller()
+
+
+  def get_db_key(self, field):
+    return "kingdom:{}:{}".format(self.name, field)
+
+
+  def load(self, store, legacy=False):
+    '''
+    Restores the kingdom from the bot's database store.
+    With legacy, fields saved before kingdoms existed are moved
+    to this kingdom's keys.
+    '''
+    if legacy:
+      for field in LEGACY_FIELDS:
+        if field in store:
+          if self.get_db_key(field) not in store:
+            store[self.get_db_key(field)] = store[field]
+          del store[field]
+
+    if self.get_db_key("channelId") not in store:
+      store[self.get_db_key("channelId")] = self.channelId
+    self.channelId = store[self.get_db_key("channelId")]
+
+    self.mystery = store.get(self.get_db_key("mystery"), "???")
+    storedTiles = store.get(self.get_db_key("tiles"), [])
+    self.tiles = load_tiles(storedTiles, self.mystery)
+    if any(isinstance(tile, dict) for tile in storedTiles): #Saved as API data by an older version
+      store[self.get_db_key("tiles")] = [tile.to_compact() for tile in self.tiles]
+    self.exploration = Exploration(store.get(self.get_db_key("exploration_timer"), "2000-01-01T00:00:00.000Z"))
+    self.tilesVersion += 1
+
+
+  def get_last_updated(self, store):
+    return self.lastChecked or store.get(self.get_db_key("last_updated"), "Unknown")
+
+
+def load_kingdoms():
+  '''
+  Returns the kingdoms set in the KINGDOMS var, a JSON list of
+  {"name": ..., "key": ..., "channel": ...} objects.
+  Without it, the one kingdom of QS_KEY and NOTIFY_CHANNEL is used.
+  '''
+  config = os.getenv("KINGDOMS")
+  if not config:
+    return [Kingdom("main", os.environ['QS_KEY'], os.environ['NOTIFY_CHANNEL'])]
+
+  kingdoms = [Kingdom(str(entry["name"]).lower(), entry["key"], entry["channel"]) for entry in json.loads(config)]
+  names = [kingdom.name for kingdom in kingdoms]
+  if not kingdoms or len(set(names)) != len(names):
+    raise ValueError("KINGDOMS needs at least one kingdom, and the names must be unique")
+  return kingdoms
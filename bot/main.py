@@ -1,5 +1,7 @@
 import os
+import functools
 from qsBot import QueslarBot
+import metrics
 import discord
 from discord.ext.commands import CommandNotFound, MissingRole, has_role, MissingRequiredArgument
 
@@ -13,70 +15,166 @@ async def on_ready():
 
 my_secret = os.environ['TOKEN']
 
-@client.group(invoke_without_command=True)
-async def help(ctx):
-  em = discord.Embed(title="Help", description="Use >help <command> for further information.", color=ctx.author.color)
+
+def cached_embed(build):
+  '''
+  Caches the embeds built by build(color). Help embeds never change,
+  so each one is only built once per author color.
+  '''
+  cache = {}
+  @functools.wraps(build)
+  def wrapper(color):
+    if color.value not in cache:
+      if len(cache) >= 64: cache.clear() #Role colors are few, this only bounds the worst case
+      cache[color.value] = build(color)
+    return cache[color.value]
+  return wrapper
+
+
+async def find_kingdom(ctx, name):
+  '''
+  Returns the kingdom named in the command, or else the one bound to
+  the channel. Sends an error and returns None if there is neither.
+  '''
+  kingdom = client.get_kingdom(ctx.channel.id, name)
+  if kingdom is None:
+    await ctx.send("Please add one of these kingdoms to the command: {}".format(client.get_kingdom_names()))
+  return kingdom
+
+@cached_embed
+def help_embed(color):
+  em = discord.Embed(title="Help", description="Use >help <command> for further information. [kingdom] is only needed when the bot watches several kingdoms and the channel is not bound to one.", color=color)
   em.add_field(name="Ping",value=">ping",inline=False)
   em.add_field(name="Get Player Investment Data", value=">player [APIKey]",inline=False)
-  em.add_field(name="Bind",value=" >bind",inline=False)
-  em.add_field(name="Update",value=">update",inline=False)
-  em.add_field(name="Tiles",value=">tiles",inline=False)
-  em.add_field(name="Timer",value=">timer [stop|restart|info]",inline=False)
+  em.add_field(name="Bind",value=" >bind [kingdom]",inline=False)
+  em.add_field(name="Update",value=">update [kingdom]",inline=False)
+  em.add_field(name="Tiles",value=">tiles [kingdom]",inline=False)
+  em.add_field(name="Timer",value=">timer [stop|restart|info] [kingdom]",inline=False)
   em.add_field(name="Stored Market Prices", value=">prices",inline=False)
+  em.add_field(name="Village Roster", value=">roster [add|remove]",inline=False)
+  em.add_field(name="Bot Stats", value=">stats",inline=False)
+  em.add_field(name="Profile", value=">profile [command|update_info] [runs]",inline=False)
+
+  return em
+
+@client.group(invoke_without_command=True)
+async def help(ctx):
+  await ctx.send(embed=help_embed(ctx.author.color))
 
-  await ctx.send(embed=em)
+@cached_embed
+def help_ping_embed(color):
+  em = discord.Embed(title="Ping", description="The bot will send a message if it is active.", color=color)
+  em.add_field(name="**Usage**",value=">ping")
+
+  return em
 
 @help.command(name="ping")
 async def help_ping(ctx):
-  em = discord.Embed(title="Ping", description="The bot will send a message if it is active.", color=ctx.author.color)
-  em.add_field(name="**Usage**",value=">ping")
+  await ctx.send(embed=help_ping_embed(ctx.author.color))
 
-  await ctx.send(embed=em)
+@cached_embed
+def help_player_embed(color):
+  em = discord.Embed(title="Get Player Investment Data", description="Displays investment info of the player from the given API key.", color=color)
+  em.add_field(name="**Usage**",value=">player [APIKey]")
+
+  return em
 
 @help.command(name="player")
 async def help_player(ctx):
-  em = discord.Embed(title="Get Player Investment Data", description="Displays investment info of the player from the given API key.", color=ctx.author.color)
-  em.add_field(name="**Usage**",value=">player [APIKey]")
+  await ctx.send(embed=help_player_embed(ctx.author.color))
+
+@cached_embed
+def help_bind_embed(color):
+  em = discord.Embed(title="Bind", description="Binds the bot to the current channel. The bot will only be able to send messages in the bound channel.", color=color)
+  em.add_field(name="**Usage**",value=">bind [kingdom]")
 
-  await ctx.send(embed=em)
+  return em
 
 @help.command(name="bind")
 async def help_bind(ctx):
-  em = discord.Embed(title="Bind", description="Binds the bot to the current channel. The bot will only be able to send messages in the bound channel.", color=ctx.author.color)
-  em.add_field(name="**Usage**",value=">bind")
+  await ctx.send(embed=help_bind_embed(ctx.author.color))
 
-  await ctx.send(embed=em)
+@cached_embed
+def help_update_embed(color):
+  em = discord.Embed(title="Update", description="Pulls information from the game and updates the bot's information.", color=color)
+  em.add_field(name="**Usage**",value=">update [kingdom]")
+
+  return em
 
 @help.command(name="update")
 async def help_update(ctx):
-  em = discord.Embed(title="Update", description="Pulls information from the game and updates the bot's information.", color=ctx.author.color)
-  em.add_field(name="**Usage**",value=">update")
+  await ctx.send(embed=help_update_embed(ctx.author.color))
+
+@cached_embed
+def help_tiles_embed(color):
+  em = discord.Embed(title="Tiles", description="Displays currently held tiles in the kingdom.", color=color)
+  em.add_field(name="**Usage**",value=">tiles [kingdom]")
 
-  await ctx.send(embed=em)
+  return em
 
 @help.command(name="tiles")
 async def help_tiles(ctx):
-  em = discord.Embed(title="Tiles", description="Displays currently held tiles in the kingdom.", color=ctx.author.color)
-  em.add_field(name="**Usage**",value=">tiles")
+  await ctx.send(embed=help_tiles_embed(ctx.author.color))
 
-  await ctx.send(embed=em)
-
-@help.command(name="timer")
-async def help_timer(ctx):
-  em = discord.Embed(title="Timer", description="Has commands related to the exploration timer.", color=ctx.author.color)
+@cached_embed
+def help_timer_embed(color):
+  em = discord.Embed(title="Timer", description="Has commands related to the exploration timer.", color=color)
   em.add_field(name="stop",value="Stops the timer.",inline=False)
   em.add_field(name="restart",value="Restarts the timer.",inline=False)
   em.add_field(name="info",value="Displays when the exploration will end.",inline=False)
-  em.add_field(name="**Usage**",value=">timer <subcommand>",inline=False)
+  em.add_field(name="**Usage**",value=">timer <subcommand> [kingdom]",inline=False)
 
-  await ctx.send(embed=em)
+  return em
+
+@help.command(name="timer")
+async def help_timer(ctx):
+  await ctx.send(embed=help_timer_embed(ctx.author.color))
+
+@cached_embed
+def help_prices_embed(color):
+  em = discord.Embed(title="Current Market Prices", description="Displays market prices stored by the bot.", color=color)
+  em.add_field(name="**Usage**",value=">prices")
+
+  return em
 
 @help.command(name="prices")
 async def help_prices(ctx):
-  em = discord.Embed(title="Current Market Prices", description="Displays market prices stored by the bot.", color=ctx.author.color)
-  em.add_field(name="**Usage**",value=">prices")
+  await ctx.send(embed=help_prices_embed(ctx.author.color))
+
+@cached_embed
+def help_roster_embed(color):
+  em = discord.Embed(title="Village Roster", description="Ranks every player in the roster by their investment, along with their income.", color=color)
+  em.add_field(name="add",value="Adds a player's API key to the roster.",inline=False)
+  em.add_field(name="remove",value="Removes a player's API key from the roster.",inline=False)
+  em.add_field(name="**Usage**",value=">roster [add|remove] [APIKey]",inline=False)
 
-  await ctx.send(embed=em)
+  return em
+
+@help.command(name="roster")
+async def help_roster(ctx):
+  await ctx.send(embed=help_roster_embed(ctx.author.color))
+
+@cached_embed
+def help_stats_embed(color):
+  em = discord.Embed(title="Bot Stats", description="Displays how long API requests, database operations, updates and commands take. Only users with the role \"Leader\" may use it.", color=color)
+  em.add_field(name="**Usage**",value=">stats")
+
+  return em
+
+@help.command(name="stats")
+async def help_stats(ctx):
+  await ctx.send(embed=help_stats_embed(ctx.author.color))
+
+@cached_embed
+def help_profile_embed(color):
+  em = discord.Embed(title="Profile", description="Profiles the next runs of a command, or the next update cycles with update_info, and posts the slowest functions. Only users with the role \"Leader\" may use it.", color=color)
+  em.add_field(name="**Usage**",value=">profile [command|update_info] [runs]")
+
+  return em
+
+@help.command(name="profile")
+async def help_profile(ctx):
+  await ctx.send(embed=help_profile_embed(ctx.author.color))
 
 @client.command()
 async def ping(ctx):
@@ -84,28 +182,38 @@ async def ping(ctx):
 
 @client.command()
 @has_role("Leader")
-async def test(ctx):
-  await client.alert_test()
+async def test(ctx, name=None):
+  kingdom = await find_kingdom(ctx, name)
+  if kingdom is not None:
+    await client.alert_test(kingdom)
 
 
 @client.command(name="update")
-async def get_info(ctx):
-  if await client.update_info():
+async def get_info(ctx, name=None):
+  kingdom = client.get_kingdom(ctx.channel.id, name)
+  if name is not None and kingdom is None:
+    await find_kingdom(ctx, name) #Unknown name
+    return
+  if await client.update_info(kingdom): #Every kingdom if the channel is not bound to one
     await ctx.send("Successfully updated with the latest information.")
   else:
     await ctx.send("Error: Could not update to the latest information.")
 
 
 @client.command(name="tiles")
-async def get_tiles(ctx):
-  await ctx.send(embed=client.get_tiles())
+async def get_tiles(ctx, name=None):
+  kingdom = await find_kingdom(ctx, name)
+  if kingdom is not None:
+    await ctx.send(embed=client.get_tiles(kingdom))
 
 
 @client.command(name="bind")
 @has_role("Leader")
-async def set_channel(ctx):
-  client.set_notification_channel(ctx.channel)
-  await ctx.send("Bound notifications to this channel.")
+async def set_channel(ctx, name=None):
+  kingdom = await find_kingdom(ctx, name)
+  if kingdom is not None:
+    client.set_notification_channel(kingdom, ctx.channel)
+    await ctx.send("Bound notifications to this channel.")
 
 
 @client.command(name="player")
@@ -121,38 +229,78 @@ async def display_prices(ctx):
 
 
 @client.group(invoke_without_command=True)
-async def timer(ctx):
-  em = discord.Embed(title="Subcommands", description="", color=ctx.author.color)
+async def roster(ctx):
+  await ctx.send(embed=await client.get_roster_report())
+
+
+@roster.command(name="add")
+@has_role("Leader")
+async def add_roster_member(ctx, key):
+  await ctx.send(await client.add_roster_member(key))
+
+
+@roster.command(name="remove")
+@has_role("Leader")
+async def remove_roster_member(ctx, key):
+  await ctx.send(client.remove_roster_member(key))
+
+
+@client.command(name="stats")
+@has_role("Leader")
+async def display_stats(ctx):
+  await ctx.send(embed=client.get_stats())
+
+
+@client.command(name="profile")
+@has_role("Leader")
+async def profile(ctx, target, runs: int = 1):
+  await ctx.send(client.arm_profiler(target, runs, ctx.channel))
+
+
+@cached_embed
+def timer_embed(color):
+  em = discord.Embed(title="Subcommands", description="", color=color)
   em.add_field(name="stop",value="Stops the timer.",inline=False)
   em.add_field(name="restart",value="Restarts the timer.",inline=False)
   em.add_field(name="info",value="Displays when the exploration will end.",inline=False)
-  em.add_field(name="**Usage**",value=">timer <subcommand>",inline=False)
+  em.add_field(name="**Usage**",value=">timer <subcommand> [kingdom]",inline=False)
 
-  await ctx.send("Please use a subcommand below.", embed=em)
+  return em
+
+@client.group(invoke_without_command=True)
+async def timer(ctx):
+  await ctx.send("Please use a subcommand below.", embed=timer_embed(ctx.author.color))
 
 
 @timer.command(name="stop")
 @has_role("Leader")
-async def stop_timer(ctx):
-  await client.stop_timer()
-  await ctx.send("Stopped the timer.")
+async def stop_timer(ctx, name=None):
+  kingdom = await find_kingdom(ctx, name)
+  if kingdom is not None:
+    await client.stop_timer(kingdom)
+    await ctx.send("Stopped the timer.")
 
 
 @timer.command(name="restart")
 @has_role("Leader")
-async def restart_timer(ctx):
-  await client.restart_timer()
-  await ctx.send("Restarted the timer.")
-  await print_timer(ctx)
+async def restart_timer(ctx, name=None):
+  kingdom = await find_kingdom(ctx, name)
+  if kingdom is not None:
+    await client.restart_timer(kingdom)
+    await ctx.send("Restarted the timer.")
+    await ctx.send(client.get_exploration_timer(kingdom))
 
 
 @timer.command(name="info")
-async def print_timer(ctx):
-  await ctx.send(client.get_exploration_timer())
+async def print_timer(ctx, name=None):
+  kingdom = await find_kingdom(ctx, name)
+  if kingdom is not None:
+    await ctx.send(client.get_exploration_timer(kingdom))
 
 
 @client.event
 async def on_command_error(ctx, err):
+  metrics.commandErrors.inc(command=ctx.command.qualified_name if ctx.command else "unknown", error=type(err).__name__)
   if isinstance(err, CommandNotFound):
     await ctx.send("Command not available. Use >help for a list of commands.")
     return
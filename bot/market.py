@@ -1,18 +1,28 @@
-import aiohttp
-import os
 from datetime import datetime
+from timestamps import parse_timestamp
 import database as db
 
 class Market:
-  def __init__(self):
-    self.prices = db.db_get("prices", { 
+  def __init__(self, api, key):
+    self.api = api
+    self.key = key #Any player's API key can read the market
+    self.version = 0 #Changes whenever the prices do
+    self.prices = { 
         "meat" : -1.0,
         "iron" : -1.0,
         "wood" : -1.0,
         "stone" : -1.0,
         "relics" : -1.0,
         "diamonds" : -1.0
-      }) 
+      }
+
+
+  async def load(self):
+    '''
+    Loads the last stored prices from the database
+    '''
+    self.prices = await db.db_get("prices", self.prices)
+    self.version += 1
 
 
   async def update(self):
@@ -29,13 +39,13 @@ class Market:
       #Only update if it's one of the 6 types in self.prices
       if item["market_type"] == "buy" and newPrice:
         self.prices[currency] = str(item["price"])
-    
+    self.version += 1
 
     toDB = {}
     toDB["prices"] = self.prices
     toDB["market_last_updated"] = newPrices[0]["sent_time"]
     # Save new prices to the database
-    db.db_set_all(toDB)
+    await db.db_set_all(toDB)
     return True
 
 
@@ -43,32 +53,28 @@ class Market:
     '''
     Returns prices from the server
     '''
-    async with aiohttp.ClientSession() as session:
-      async with session.get('https://queslar.com/api/market/history-latest/'+os.environ['QS_KEY']) as res:
-        if res.status == 200:
-          return await res.json()
-
-        else:
-          print("Server error: {}".format(res.status))
-          return []
+    return await self.api.get_market_prices(self.key)
 
 
-  def is_outdated(self):
+  async def is_outdated(self):
     '''
     Returns True if the most recent timestamp occured more 
     than 1 hour ago.
     '''
-    diff =  datetime.utcnow() - datetime.strptime(db.db_get("market_last_updated", "2000-01-01T00:00:00.000Z"), "%Y-%m-%dT%H:%M:%S.000Z")
+    lastUpdated = await db.db_get("market_last_updated", "2000-01-01T00:00:00.000Z")
+    diff =  datetime.utcnow() - parse_timestamp(lastUpdated)
     minutes = diff.seconds / 60
     return minutes > 60
 
 
-  def price_to_str(self, price):
+  @staticmethod
+  def price_to_str(price):
     '''
     Return a truncated str version of the price
     '''
     if price // 1000000000000000 > 0: #quadrillion
       trunc = str(price / 1000000000000000)
+      return trunc[:trunc.find(".")+3] + "q"
     elif price // 1000000000000 > 0: #trillion
       trunc = str(price / 1000000000000)
       return trunc[:trunc.find(".")+3] + "t"
@@ -0,0 +1,181 @@
+import functools
+import os
+import time
+from contextlib import contextmanager
+from aiohttp import web
+
+# Upper bounds of the latency buckets, in seconds
+LATENCY_BUCKETS = [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+class Counter:
+  '''
+  A count per set of label values, e.g. requests per endpoint
+  '''
+  def __init__(self, name, help):
+    self.name = name
+    self.help = help
+    self.values = {} #Sorted label items -> count
+
+
+  def inc(self, amount=1, **labels):
+    key = tuple(sorted(labels.items()))
+    self.values[key] = self.values.get(key, 0) + amount
+
+
+  def render(self):
+    lines = ["# HELP {} {}".format(self.name, self.help), "# TYPE {} counter".format(self.name)]
+    for key, value in self.values.items():
+      lines.append("{}{} {}".format(self.name, format_labels(key), value))
+    return lines
+
+
+  def summarize(self):
+    return ["{}{} {}".format(self.name, format_labels(key), value) for key, value in self.values.items()]
+
+
+class Gauge(Counter):
+  '''
+  A value per set of label values that can go up and down, e.g. a queue size
+  '''
+  def set(self, value, **labels):
+    self.values[tuple(sorted(labels.items()))] = value
+
+
+  def render(self):
+    lines = super().render()
+    lines[1] = "# TYPE {} gauge".format(self.name)
+    return lines
+
+
+class Histogram:
+  '''
+  Observed values per set of label values, counted into buckets
+  '''
+  def __init__(self, name, help, buckets=LATENCY_BUCKETS):
+    self.name = name
+    self.help = help
+    self.buckets = buckets
+    self.values = {} #Sorted label items -> [bucket counts..., count, sum, max]
+
+
+  def observe(self, value, **labels):
+    key = tuple(sorted(labels.items()))
+    series = self.values.get(key)
+    if series is None:
+      series = self.values[key] = [0] * (len(self.buckets) + 3)
+    for i, bound in enumerate(self.buckets):
+      if value <= bound:
+        series[i] += 1
+        break
+    series[-3] += 1
+    series[-2] += value
+    series[-1] = max(series[-1], value)
+
+
+  @contextmanager
+  def time(self, **labels):
+    '''
+    Observes the seconds spent in the with block
+    '''
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      self.observe(time.perf_counter() - start, **labels)
+
+
+  def timed(self, **labels):
+    '''
+    Decorates a coroutine function to observe how long its calls take
+    '''
+    def decorator(function):
+      @functools.wraps(function)
+      async def wrapper(*args, **kwargs):
+        with self.time(**labels):
+          return await function(*args, **kwargs)
+      return wrapper
+    return decorator
+
+
+  def render(self):
+    lines = ["# HELP {} {}".format(self.name, self.help), "# TYPE {} histogram".format(self.name)]
+    for key, series in self.values.items():
+      cumulative = 0
+      for bound, count in zip(self.buckets, series):
+        cumulative += count
+        lines.append("{}_bucket{} {}".format(self.name, format_labels(key + (("le", bound),)), cumulative))
+      lines.append("{}_bucket{} {}".format(self.name, format_labels(key + (("le", "+Inf"),)), series[-3]))
+      lines.append("{}_count{} {}".format(self.name, format_labels(key), series[-3]))
+      lines.append("{}_sum{} {}".format(self.name, format_labels(key), series[-2]))
+    return lines
+
+
+  def summarize(self):
+    return [
+      "{}{} n={} avg={:.1f}ms max={:.1f}ms".format(
+        self.name, format_labels(key), series[-3], series[-2] / series[-3] * 1000, series[-1] * 1000)
+      for key, series in self.values.items()
+    ]
+
+
+def format_labels(key):
+  if not key: return ""
+  return "{" + ",".join('{}="{}"'.format(name, value) for name, value in key) + "}"
+
+
+apiSeconds = Histogram("qs_api_request_seconds", "Latency of Queslar API requests")
+apiRequests = Counter("qs_api_requests_total", "Queslar API requests by status")
+playerCache = Counter("qs_player_cache_total", "Player data cache lookups")
+redisSeconds = Histogram("redis_operation_seconds", "Latency of Redis operations")
+updateSeconds = Histogram("update_stage_seconds", "Time spent in each stage of update_info")
+updateSkipped = Counter("update_skipped_total", "Updates skipped because the kingdom data had not changed")
+commandSeconds = Histogram("bot_command_seconds", "Latency of bot commands")
+commandErrors = Counter("bot_command_errors_total", "Bot commands that failed")
+notifyQueued = Gauge("notify_queue_depth", "Notifications waiting to be sent")
+notifySeconds = Histogram("notify_send_seconds", "Latency of sending a notification message")
+notifyDelay = Histogram("notify_delivery_seconds", "Time from queueing a notification to sending it",
+  buckets=[0.5, 1, 2.5, 5, 10, 30, 60, 120])
+ALL = [
+  apiSeconds, apiRequests, playerCache, redisSeconds, updateSeconds, updateSkipped, commandSeconds, commandErrors,
+  notifyQueued, notifySeconds, notifyDelay
+]
+
+
+def render():
+  '''
+  Returns every metric in the Prometheus text format
+  '''
+  lines = []
+  for metric in ALL:
+    lines += metric.render()
+  return "\n".join(lines) + "\n"
+
+
+def summarize():
+  '''
+  Returns a short line per series, for reading in Discord
+  '''
+  lines = []
+  for metric in ALL:
+    lines += metric.summarize()
+  return lines
+
+
+async def start_server():
+  '''
+  Serves the metrics at /metrics if METRICS_PORT is set.
+  Returns the runner, or None if the server is off.
+  '''
+  port = os.getenv("METRICS_PORT")
+  if not port: return None
+
+  async def handle(request):
+    return web.Response(text=render(), content_type="text/plain")
+
+  app = web.Application()
+  app.router.add_get("/metrics", handle)
+  runner = web.AppRunner(app)
+  await runner.setup()
+  await web.TCPSite(runner, os.getenv("METRICS_HOST", "127.0.0.1"), int(port)).start()
+  print("Serving metrics on port {}".format(port))
+  return runner
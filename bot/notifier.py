@@ -0,0 +1,149 @@
+import asyncio
+import os
+import time
+import discord
+import metrics
+
+EMBED_TEXT_LIMIT = 4000 #Embed descriptions are limited to 4096 characters, leaving room for code blocks
+
+
+def trim_lines(lines):
+  '''
+  Drops lines from the end until they fit in an embed description
+  once joined by newlines. The first line is always kept.
+  Returns the same list.
+  '''
+  size = sum(len(line) + 1 for line in lines)
+  while len(lines) > 1 and size > EMBED_TEXT_LIMIT:
+    size -= len(lines.pop()) + 1
+  return lines
+
+
+class Notice:
+  '''
+  One event to post to a channel, e.g. tiles that were lost.
+  Without fields, it is sent as a plain message.
+  '''
+  __slots__ = ("title", "fields", "color", "mention", "queued")
+
+  def __init__(self, title, fields=(), color=0x0080c0, mention=False):
+    self.title = title
+    self.fields = list(fields) #(name, value) pairs
+    self.color = color
+    self.mention = mention #Ping @here
+    self.queued = time.monotonic()
+
+
+class TokenBucket:
+  '''
+  Allows capacity sends at once, refilled at rate sends per second
+  '''
+  def __init__(self, rate, capacity):
+    self.rate = rate
+    self.capacity = capacity
+    self.tokens = capacity
+    self.updated = time.monotonic()
+
+
+  async def acquire(self):
+    while True:
+      now = time.monotonic()
+      self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+      self.updated = now
+      if self.tokens >= 1:
+        self.tokens -= 1
+        return
+      await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class Notifier:
+  '''
+  Queues notices per channel and sends them in the background.
+  Notices queued within NOTIFY_COALESCE seconds of each other are
+  sent together as one message. Each channel has its own rate limit
+  bucket and sender, so channels are served concurrently.
+  '''
+  def __init__(self):
+    self.coalesceDelay = float(os.getenv("NOTIFY_COALESCE", 2))
+    self.rate = float(os.getenv("NOTIFY_RATE", 1)) #Messages per second and channel
+    self.burst = int(os.getenv("NOTIFY_BURST", 5))
+    self.queues = {} #channel id -> list of notices
+    self.buckets = {} #channel id -> TokenBucket
+    self.senders = {} #channel id -> running sender task
+
+
+  def notify(self, channel, notice):
+    '''
+    Queues the notice for the channel
+    '''
+    if channel is None:
+      print("Error: Could not send message to notification channel. Bot could not find the specified channel.")
+      return
+
+    self.queues.setdefault(channel.id, []).append(notice)
+    self.update_depth()
+    if channel.id not in self.senders:
+      self.senders[channel.id] = asyncio.ensure_future(self.send_queued(channel))
+
+
+  def update_depth(self):
+    metrics.notifyQueued.set(sum(len(queue) for queue in self.queues.values()))
+
+
+  async def send_queued(self, channel):
+    '''
+    Sends the channel's queued notices until its queue is empty
+    '''
+    try:
+      await asyncio.sleep(self.coalesceDelay) #Let notices close in time gather
+      bucket = self.buckets.setdefault(channel.id, TokenBucket(self.rate, self.burst))
+      while self.queues.get(channel.id):
+        await bucket.acquire()
+        notices = self.queues.pop(channel.id)
+        self.update_depth()
+        await self.send(channel, notices)
+    finally:
+      del self.senders[channel.id]
+
+
+  async def send(self, channel, notices):
+    content, embed = self.build_message(notices)
+    start = time.monotonic()
+    try:
+      await channel.send(content, embed=embed)
+    except (AttributeError, discord.HTTPException) as e:
+      print("Error: Could not send message to notification channel: {}".format(repr(e)))
+      return
+    now = time.monotonic()
+    metrics.notifySeconds.observe(now - start)
+    for notice in notices:
+      metrics.notifyDelay.observe(now - notice.queued)
+
+
+  @staticmethod
+  def build_message(notices):
+    '''
+    Returns the content and embed of one message holding all notices
+    '''
+    mention = "@here" if any(notice.mention for notice in notices) else None
+    if len(notices) == 1:
+      notice = notices[0]
+      if not notice.fields:
+        return " ".join(part for part in [mention, notice.title] if part), None
+      embed = discord.Embed(title=notice.title, color=notice.color)
+      for name, value in notice.fields[:25]: #Embeds hold at most 25 fields
+        embed.add_field(name=name, value=value, inline=False)
+      return mention, embed
+
+    lines = []
+    for notice in notices:
+      lines.append("**{}**".format(notice.title))
+      lines += ["{}: {}".format(name, value) for name, value in notice.fields]
+    trim_lines(lines)
+    color = next((notice.color for notice in notices if notice.mention), notices[0].color)
+    return mention, discord.Embed(title="Kingdom Update", description="\n".join(lines), color=color)
+
+
+  def close(self):
+    for sender in list(self.senders.values()):
+      sender.cancel()
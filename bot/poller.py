@@ -0,0 +1,43 @@
+import os
+from datetime import datetime
+
+class AdaptivePoller:
+  '''
+  Decides how long to wait between kingdom updates.
+  Updates are frequent in a window around the end of an exploration,
+  when tiles change, and rare when no exploration is running.
+  Failed updates back off exponentially.
+  All times are in seconds.
+  '''
+  def __init__(self):
+    self.minInterval = float(os.getenv("POLL_MIN_INTERVAL", 60))
+    self.interval = float(os.getenv("POLL_INTERVAL", 300)) #While an exploration is running
+    self.idleInterval = float(os.getenv("POLL_IDLE_INTERVAL", 900)) #While no exploration is running
+    self.maxInterval = float(os.getenv("POLL_MAX_INTERVAL", 1800))
+    self.window = float(os.getenv("POLL_WINDOW", 600)) #Before and after the exploration end
+    self.failures = 0
+
+
+  def record(self, success):
+    '''
+    Counts consecutive failed updates
+    '''
+    self.failures = 0 if success else self.failures + 1
+
+
+  def next_delay(self, exploration):
+    '''
+    Returns the seconds to wait before the next update
+    '''
+    untilEnd = (exploration.get_end_time() - datetime.utcnow()).total_seconds()
+    if abs(untilEnd) <= self.window:
+      delay = self.minInterval
+    elif untilEnd < 0:
+      delay = self.idleInterval
+    else:
+      # Do not sleep past the start of the window
+      delay = max(self.minInterval, min(self.interval, untilEnd - self.window))
+
+    if self.failures:
+      delay *= 2**min(self.failures, 16)
+    return min(delay, self.maxInterval)
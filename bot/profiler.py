@@ -0,0 +1,72 @@
+import cProfile
+import io
+import os
+import pstats
+from datetime import datetime
+import discord
+
+TOP_FUNCTIONS = 30
+
+class Profiler:
+  '''
+  Profiles the next runs of a command or of update_info with cProfile.
+  Nothing is profiled unless a target was armed, so it costs a dict
+  lookup per run while it is off.
+  Each profile is posted to the channel that armed it and saved to
+  PROFILE_DIR, so it can be compared with later ones.
+  '''
+  def __init__(self):
+    self.directory = os.getenv("PROFILE_DIR", "profiles")
+    self.armed = {} #target -> [runs left, channel]
+    self.active = False #cProfile can only run one profile at a time
+
+
+  def arm(self, target, runs, channel):
+    self.armed[target] = [runs, channel]
+
+
+  async def run(self, target, function, *args):
+    '''
+    Returns function(*args), profiling it if the target is armed
+    '''
+    if target not in self.armed or self.active:
+      return await function(*args)
+
+    entry = self.armed[target]
+    entry[0] -= 1
+    if entry[0] <= 0:
+      del self.armed[target]
+
+    profile = cProfile.Profile()
+    self.active = True
+    profile.enable()
+    try:
+      return await function(*args)
+    finally:
+      profile.disable()
+      self.active = False
+      await self.post(target, profile, entry[1], entry[0])
+
+
+  async def post(self, target, profile, channel, runsLeft):
+    '''
+    Saves the profile and posts its hottest functions
+    '''
+    name = "{}-{}".format(target.replace(" ", "_"), datetime.utcnow().strftime("%Y%m%d-%H%M%S"))
+    os.makedirs(self.directory, exist_ok=True)
+    path = os.path.join(self.directory, name + ".prof")
+    profile.dump_stats(path)
+
+    stream = io.StringIO()
+    stats = pstats.Stats(profile, stream=stream).strip_dirs().sort_stats("cumulative")
+    stats.print_stats(TOP_FUNCTIONS)
+    # The profile covers every task that ran meanwhile, not only the target
+    summary = "Profile of {} ({:.3f}s total, {} runs left). Saved to {}".format(
+      target, stats.total_tt, max(runsLeft, 0), path)
+    try:
+      await channel.send(summary, files=[
+        discord.File(io.BytesIO(stream.getvalue().encode()), filename=name + ".txt"),
+        discord.File(path, filename=name + ".prof")
+      ])
+    except (AttributeError, discord.HTTPException) as e:
+      print("Could not post the profile of {}: {}".format(target, repr(e)))
@@ -1,16 +1,25 @@
-from discord.ext import tasks, commands
+from discord.ext import commands
 import discord
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from dotenv import load_dotenv
 load_dotenv()
 import os
-import aiohttp
+import asyncio
+import heapq
+import time
 from datetime import datetime
 import json
-from tile import Tile
+import hashlib
+from tile import build_tiles
 from exploration import Exploration
 from market import Market
-import calculator as calc
+from api import QueslarClient
+from kingdom import load_kingdoms
+from timers import TimerEngine
+from profiler import Profiler
+from notifier import Notifier, Notice, trim_lines
+import batch
+import metrics
+import report
 import database as db
 
 
@@ -22,190 +31,418 @@ class QueslarBot(commands.Bot):
   def __init__(self,  *args, **kwargs):
     super().__init__(*args, **kwargs)
     
-    self.db = db.db_get_all()
+    self.db = db.TrackedStore() #Loaded from the database in load_db
+
+    self.kingdoms = load_kingdoms() #Each has its own tiles, exploration and channel
+    self.pollTask = None #Started in start
+    self.timers = TimerEngine("timers") #Exploration alerts, keyed by (kingdom name, event)
+    # What to do with alerts that were due while the bot was down: "fire" or "skip"
+    self.missedAlertPolicy = os.getenv("MISSED_ALERT_POLICY", "fire")
+    self.missedAlertGrace = float(os.getenv("MISSED_ALERT_GRACE", 60)) #Minutes, older alerts are skipped
+    # Minutes before the end of an exploration to send reminders at
+    self.reminderOffsets = [int(minutes) for minutes in os.getenv("EXPLORATION_REMINDERS", "40").split(",")]
+
+    self.api = QueslarClient() #Shared by all API requests
+    self.market = Market(self.api, self.kingdoms[0].key)
+    self.marketMessage = None #(cache key, message) of the last >prices
+    self.rosterConcurrency = int(os.getenv("ROSTER_CONCURRENCY", 5))
+    self.metricsServer = None #Started in start if METRICS_PORT is set
+    self.profiler = Profiler()
+    self.notifier = Notifier() #Sends every notification to the kingdom channels
+
+
+  async def start(self, *args, **kwargs):
+    '''
+    Loads the saved state before connecting to Discord,
+    so commands never see an empty bot.
+    '''
+    await self.load_db()
+    await self.restore_timers() #Started in poll_loop, once the channels are known
+    self.pollTask = asyncio.ensure_future(self.poll_loop())
+    self.metricsServer = await metrics.start_server()
+    await super().start(*args, **kwargs)
+
+
+  async def close(self):
+    if self.pollTask is not None:
+      self.pollTask.cancel()
+    self.timers.stop()
+    self.notifier.close()
+    if self.metricsServer is not None:
+      await self.metricsServer.cleanup()
+    await super().close()
+    await self.api.close()
+    await db.db_close()
+
+
+  async def load_db(self):
+    '''
+    Restores the bot's state from the database.
+    '''
+    self.db = db.TrackedStore(await db.db_get_all())
 
-    if "channelId" not in self.db:
-      self.db["channelId"] = os.environ['NOTIFY_CHANNEL']
+    for i, kingdom in enumerate(self.kingdoms):
+      kingdom.load(self.db, legacy=(i == 0)) #The first kingdom takes over single kingdom data
 
-    
-    self.notificationChannel = None #Initialized in setup_loop
+    await self.market.load()
 
-    self.tiles = [Tile(t) for t in self.db.get("tiles", [])]
-    self.mystery = self.db.get("mystery","???")
-    
-    self.exploration = Exploration(self.db.get("exploration_timer","2000-01-01T00:00:00.000Z"))
-    self.scheduler = AsyncIOScheduler({'apscheduler.timezone': 'UTC'})
 
-    self.market = Market()
+  async def restore_timers(self):
+    '''
+    Schedules the alerts saved before the last shutdown again.
+    Alerts that were due while the bot was down are fired or
+    skipped according to the missed alert policy.
+    '''
+    now = datetime.utcnow()
+    fired = skipped = 0
+    reminders = {"reminder:{}".format(minutes):minutes for minutes in self.reminderOffsets}
+    for key, time in (await self.timers.load()).items():
+      name, event = key
+      kingdom = self.get_kingdom(None, name)
+      # Kingdoms no longer watched, reminders no longer configured and debugging timers are dropped
+      if kingdom is None or (event != "exploration" and event not in reminders):
+        self.timers.cancel(key)
+        continue
+
+      if event == "exploration":
+        callback, args = self.alert_exploration, (kingdom,)
+      else:
+        callback, args = self.alert_reminder, (kingdom, reminders[event])
+
+      if time < now:
+        missedFor = (now - time).total_seconds() / 60
+        # A reminder is pointless once the exploration is over
+        outdated = event != "exploration" and kingdom.exploration.is_done()
+        if self.missedAlertPolicy != "fire" or missedFor > self.missedAlertGrace or outdated:
+          self.timers.cancel(key)
+          skipped += 1
+          continue
+        fired += 1
+      self.timers.schedule(key, time, callback, *args) #Missed alerts fire once the channels are set up
+
+    await self.timers.save()
+    print("Restored {} alerts, {} of them missed, {} missed alerts skipped".format(len(self.timers), fired, skipped))
+
+
+  async def invoke(self, ctx):
+    '''
+    Runs a command, timing it for the metrics
+    '''
+    if ctx.command is None:
+      return await super().invoke(ctx)
+    with metrics.commandSeconds.time(command=ctx.command.qualified_name):
+      await self.profiler.run(ctx.command.qualified_name, super().invoke, ctx)
+
+
+  def arm_profiler(self, target, runs, channel):
+    '''
+    Profiles the next runs of a command, or of update_info
+    for the next update cycles. Returns a message describing the result.
+    '''
+    if target != "update_info":
+      command = self.get_command(target)
+      if command is None:
+        return "There is no command or update_info named {}.".format(target)
+      target = command.qualified_name
+    runs = max(1, min(runs, 20))
+    self.profiler.arm(target, runs, channel)
+    return "Profiling the next {} run(s) of {}.".format(runs, target)
+
+
+  def get_stats(self):
+    '''
+    Returns an embed with a line for every metric series
+    '''
+    embed = discord.Embed(title="Bot Stats", color=0x0080c0)
+    lines = metrics.summarize() or ["Nothing was measured yet."]
+    trim_lines(lines)
+    embed.description = "```\n{}```".format("\n".join(lines))
+    embed.set_footer(text="Player cache: {hits} hits, {coalesced} coalesced, {misses} misses, {size} cached".format(**self.api.get_cache_stats()))
+    return embed
+
+
+  def get_kingdom(self, channelId, name=None):
+    '''
+    Returns the kingdom with the given name, or else the one bound to
+    the channel. With a single kingdom, it is always returned.
+    Returns None if no kingdom matches.
+    '''
+    if name is not None:
+      return next((kingdom for kingdom in self.kingdoms if kingdom.name == name.lower()), None)
+    if len(self.kingdoms) == 1:
+      return self.kingdoms[0]
+    return next((kingdom for kingdom in self.kingdoms if str(kingdom.channelId) == str(channelId)), None)
+
 
-    self.update_info.start()
-    self.scheduler.start()
+  def get_kingdom_names(self):
+    return ", ".join(kingdom.name for kingdom in self.kingdoms)
   
 
-  async def alert_exploration(self):
+  async def alert_exploration(self, kingdom):
     '''
     Sends a message to the notification channel when
     the exploration finishes.
     '''
-    print("Alert: Exploration done.")
-    try:
-      await self.notificationChannel.send("@here Exploration done!")
-    except AttributeError:
-      print("Error: Could not send message to notification channel. Bot could not find the specified channel.")
+    print("Alert: Exploration done in {}.".format(kingdom.name))
+    self.notify(kingdom, "Exploration done!", mention=True)
 
 
-  async def alert_reminder(self):
+  async def alert_reminder(self, kingdom, minutes):
     '''
     Sends a reminder to the notification channel when
     the exploration is nearly finished.
     '''
-    try:
-      await self.notificationChannel.send(
-        "@here Exploration will end in {} minutes."
-        .format(self.exploration.get_reminder_interval())
-      )
-    except AttributeError:
-      print("Error: Could not send message to notification channel. Bot could not find the specified channel.")
+    self.notify(kingdom, "Exploration will end in {} minutes.".format(minutes), mention=True)
 
 
-  async def alert_test(self):
+  async def alert_test(self, kingdom):
     '''
     Debugging method for sending test message
     '''
     print("Alert test")
-    try:
-      await self.notificationChannel.send("Test alert @here")
-    except AttributeError:
-      print("Error: Could not send message to notification channel. Bot could not find the specified channel.")
+    self.notify(kingdom, "Test alert", mention=True)
+
+
+  def notify(self, kingdom, title, fields=(), color=0x0080c0, mention=False):
+    '''
+    Queues a notification for the kingdom's channel.
+    The kingdom is named when the bot watches several.
+    '''
+    if len(self.kingdoms) > 1:
+      title = "{}: {}".format(kingdom.name, title)
+    self.notifier.notify(kingdom.channel, Notice(title, fields, color, mention))
   
 
-  @tasks.loop(minutes=5)
-  async def update_info(self):
+  async def poll_loop(self):
+    '''
+    Runs update_info for every kingdom until the bot closes.
+    The first updates are spread evenly over the poll interval, so the
+    kingdoms do not all hit the API at once. After that, each kingdom
+    waits as long as its own poller decides.
+    '''
+    await self.setup_loop()
+    self.timers.start() #Alerts missed while the bot was down fire now
+    spacing = self.kingdoms[0].poller.interval / len(self.kingdoms)
+    now = time.monotonic()
+    queue = [(now + i * spacing, i) for i in range(len(self.kingdoms))] #(next update, kingdom index)
+    while not self.is_closed():
+      due, i = heapq.heappop(queue)
+      await asyncio.sleep(max(0, due - time.monotonic()))
+      kingdom = self.kingdoms[i]
+      try:
+        success = await self.profiler.run("update_info", self.update_info, kingdom)
+      except Exception as e:
+        print("Update of {} failed: {}".format(kingdom.name, repr(e)))
+        success = False
+      kingdom.poller.record(success)
+      heapq.heappush(queue, (time.monotonic() + kingdom.poller.next_delay(kingdom.exploration), i))
+
+
+  async def update_info(self, kingdom=None):
     '''
     Updates the database from the API server, sends messages if
     tiles change, and starts a timer for kd explorations if one 
-    is running.
+    is running. Without a kingdom, every kingdom is updated.
     '''
+    if kingdom is None:
+      results = [await self.update_info(kingdom) for kingdom in self.kingdoms]
+      return all(results)
+
     #print("{}> Updating info".format(datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")))
     success = False
 
     #Update to database
-    data = await self.get_qs_data()
+    with metrics.updateSeconds.time(stage="fetch"):
+      data = await self.get_qs_data(kingdom.key)
     if(data):
-      try:
-        #Update only if anything changed
-        if "mapMisc" in data["kingdom"] and self.mystery != data["kingdom"]["mapMisc"]["mystery_tile"]:
-          self.mystery = data["kingdom"]["mapMisc"]["mystery_tile"]
-          self.db["mystery"] = self.mystery
-          db.db_set("mystery", self.mystery) # Important to update asap
-          for tile in self.tiles:
-            tile.set_mystery(self.mystery)
-
-        await self.update_tile_status(data["kingdom"]["tiles"])
-
-        dataExplo = Exploration(data["kingdom"]["activeExploration"]["exploration_timer"])
-        if self.exploration != dataExplo:
-          self.db["exploration_timer"] = data["kingdom"]["activeExploration"]["exploration_timer"]
-          self.exploration = dataExplo
-
-        self.db["last_updated"] = datetime.utcnow().strftime("%Y-%m-%d %H:%M")
+      with metrics.updateSeconds.time(stage="fingerprint"):
+        try:
+          fingerprint = self.get_kingdom_fingerprint(data["kingdom"])
+        except KeyError:
+          fingerprint = None
+      now = datetime.utcnow().strftime("%Y-%m-%d %H:%M")
+
+      if fingerprint is not None and fingerprint == kingdom.fingerprint:
+        #Nothing changed, so the tiles, exploration and database are already up to date
+        kingdom.skippedUpdates += 1
+        metrics.updateSkipped.inc(kingdom=kingdom.name)
+        kingdom.lastChecked = now
         success = True
-      except KeyError as e:
-        print("Failed to index {} in API data".format(str(e)))
+      else:
+        if kingdom.skippedUpdates:
+          print("Kingdom {} changed, skipped {} unchanged updates so far".format(kingdom.name, kingdom.skippedUpdates))
+        success = await self.apply_kingdom_data(kingdom, data)
+        if success:
+          kingdom.fingerprint = fingerprint
+          kingdom.lastChecked = now
+          self.db[kingdom.get_db_key("last_updated")] = now
     else:  
-      print("{}> Failed to get API data".format(datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")))
-
-    # Start exploration timer if there isn't one
-    if len(self.scheduler.get_jobs()) == 0 and not self.exploration.is_done():
-      end = self.exploration.get_end_time()
-      remind = self.exploration.get_reminder_time()
-      self.scheduler.add_job(self.alert_exploration, "date", run_date=end, id='exploration')
-      self.scheduler.add_job(self.alert_reminder, "date", run_date=remind, id='explorationReminder')
-      #self.scheduler.add_job(self.alert_test, "interval", minutes=1, id='test') #Debugging alerts
-      print("Starting alert for {} UTC...".format(end))
-
-    # Save data to the cloud database
-    db.db_set_all(self.db)
+      print("{}> Failed to get API data for {}".format(datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"), kingdom.name))
+
+    # Start the exploration timers if there are none, or move them if the end changed.
+    # A due alert that has not fired yet is left alone, it removes itself once sent.
+    with metrics.updateSeconds.time(stage="alert"):
+      scheduled = self.timers.get((kingdom.name, "exploration"))
+      if not kingdom.timerStopped and scheduled != kingdom.exploration.get_end_time():
+        if not kingdom.exploration.is_done():
+          self.schedule_alerts(kingdom)
+        elif scheduled is not None: #The exploration it was set for ended early
+          self.cancel_alerts(kingdom)
+
+    # Save changed data to the cloud database
+    with metrics.updateSeconds.time(stage="persist"):
+      await self.db.flush()
+      await self.timers.save()
     
     return success
 
 
-  @update_info.before_loop
+  @staticmethod
+  def get_kingdom_fingerprint(kingdom):
+    '''
+    Returns a hash of the parts of the kingdom data that update_info uses
+    '''
+    relevant = [kingdom["tiles"], kingdom.get("mapMisc"), kingdom["activeExploration"]]
+    return hashlib.blake2b(json.dumps(relevant, separators=(",", ":")).encode(), digest_size=16).digest()
+
+
+  def schedule_alerts(self, kingdom):
+    '''
+    Sets the timers for the end of the kingdom's exploration
+    and for each reminder that has not passed yet.
+    '''
+    end = kingdom.exploration.get_end_time()
+    now = datetime.utcnow()
+    self.timers.schedule((kingdom.name, "exploration"), end, self.alert_exploration, kingdom)
+    for minutes in self.reminderOffsets:
+      key = (kingdom.name, "reminder:{}".format(minutes))
+      remind = kingdom.exploration.get_reminder_time(minutes)
+      if remind > now:
+        self.timers.schedule(key, remind, self.alert_reminder, kingdom, minutes)
+      else:
+        self.timers.cancel(key)
+    #self.timers.schedule((kingdom.name, "test"), now, self.alert_test, kingdom) #Debugging alerts
+    print("Starting alert for {} at {} UTC...".format(kingdom.name, end))
+
+
+  def cancel_alerts(self, kingdom):
+    '''
+    Cancels every timer of the kingdom, including reminders
+    for offsets that are no longer configured
+    '''
+    self.timers.cancel_prefix((kingdom.name,))
+
+
+  async def apply_kingdom_data(self, kingdom, data):
+    '''
+    Updates the tiles, mystery and exploration from the API data.
+    Returns True if the data could be read.
+    '''
+    try:
+      with metrics.updateSeconds.time(stage="parse"):
+        #Update only if anything changed
+        if "mapMisc" in data["kingdom"] and kingdom.mystery != data["kingdom"]["mapMisc"]["mystery_tile"]:
+          kingdom.mystery = data["kingdom"]["mapMisc"]["mystery_tile"]
+          self.db[kingdom.get_db_key("mystery")] = kingdom.mystery
+          for tile in kingdom.tiles:
+            tile.set_mystery(kingdom.mystery)
+          kingdom.tilesVersion += 1
+
+        newTiles = build_tiles(data["kingdom"]["tiles"], kingdom.mystery)
+        dataExplo = Exploration(data["kingdom"]["activeExploration"]["exploration_timer"])
+
+      await self.update_tile_status(kingdom, newTiles)
+
+      if kingdom.exploration != dataExplo:
+        self.db[kingdom.get_db_key("exploration_timer")] = data["kingdom"]["activeExploration"]["exploration_timer"]
+        kingdom.exploration = dataExplo
+      return True
+    except KeyError as e:
+      print("Failed to index {} in API data".format(str(e)))
+      return False
+
+
   async def setup_loop(self):
     await self.wait_until_ready()
-    #Initialize channel
-    self.notificationChannel = self.get_channel(int(self.db.get("channelId")))
-    if(not self.notificationChannel):
-      print("Failed to find channel.")
+    #Initialize channels
+    for kingdom in self.kingdoms:
+      kingdom.channel = self.get_channel(int(kingdom.channelId))
+      if(not kingdom.channel):
+        print("Failed to find channel for {}.".format(kingdom.name))
 
 
-  async def get_qs_data(self, key=os.environ['QS_KEY']):
+  async def get_qs_data(self, key):
     '''
     Returns player data from the API server
     '''
-    async with aiohttp.ClientSession() as session:
-      async with session.get('https://queslar.com/api/player/full/'+key) as res:
-        if res.status == 200:
-          return await res.json()
-        else:
-          print("Server error: {}".format(res.status))
-          return {}
+    return await self.api.get_player(key)
 
 
-  async def update_tile_status(self, tiles):
+  async def update_tile_status(self, kingdom, newTiles):
     '''
     Sends a message to the notification channel if 
     tiles have changed since the last update.
     It uses newTiles and the current (old) tiles for
     comparison.
     '''
-    i, j = 0, 0
-    lost, gained = [], []
-    oldTiles = self.tiles
-    newTiles = [Tile(t) for t in tiles]
-    # Iterate through the tiles and compare changes
-    while i < len(oldTiles) and j < len(newTiles):
-      if oldTiles[i].id == newTiles[j].id:
-        i += 1
-        j += 1
-      elif oldTiles[i].id < newTiles[j].id:
-        lost.append((oldTiles[i].get_coords(), str(oldTiles[i])))
-        i += 1
-      else:
-        gained.append((newTiles[j].get_coords(), str(newTiles[j])))
-        j += 1
-    if len(oldTiles) < len(newTiles):
-      gained += [(tile.get_coords(), str(tile)) for tile in newTiles[j:]]
-    elif len(oldTiles) > len(newTiles):
-      lost += [(tile.get_coords(), str(tile)) for tile in oldTiles[i:]]
+    with metrics.updateSeconds.time(stage="diff"):
+      i, j = 0, 0
+      lost, gained = [], []
+      oldTiles = kingdom.tiles
+      # Iterate through the tiles and compare changes
+      while i < len(oldTiles) and j < len(newTiles):
+        if oldTiles[i].id == newTiles[j].id:
+          i += 1
+          j += 1
+        elif oldTiles[i].id < newTiles[j].id:
+          lost.append((oldTiles[i].get_coords(), str(oldTiles[i])))
+          i += 1
+        else:
+          gained.append((newTiles[j].get_coords(), str(newTiles[j])))
+          j += 1
+      if len(oldTiles) < len(newTiles):
+        gained += [(tile.get_coords(), str(tile)) for tile in newTiles[j:]]
+      elif len(oldTiles) > len(newTiles):
+        lost += [(tile.get_coords(), str(tile)) for tile in oldTiles[i:]]
     
     #Send result to channel
     if len(gained) != 0 or len(lost) != 0:
-      await self.post_tile_update(gained, lost)
-      self.tiles = newTiles
-      self.db["tiles"] = tiles #Update db if anything changed
+      with metrics.updateSeconds.time(stage="alert"):
+        await self.post_tile_update(kingdom, gained, lost)
+      kingdom.tiles = newTiles
+      kingdom.tilesVersion += 1
+      self.db[kingdom.get_db_key("tiles")] = [tile.to_compact() for tile in newTiles] #Update db if anything changed
 
 
-  def set_notification_channel(self, channel):
+  def set_notification_channel(self, kingdom, channel):
     '''
-    Sets the notification channel to the given channel.
+    Sets the kingdom's notification channel to the given channel.
     '''
-    self.db["channelId"] = channel.id
-    self.notificationChannel = channel
+    self.db[kingdom.get_db_key("channelId")] = channel.id
+    kingdom.channelId = channel.id
+    kingdom.channel = channel
+    self.db.flush_later()
 
 
-  def get_tiles(self):
+  def get_tiles(self, kingdom):
     '''
-    Returns an embed featuring all tiles held by the kd
+    Returns an embed featuring all tiles held by the kd.
+    It is only rebuilt after the tiles or the update time change.
     '''
-    embed = discord.Embed(title="Kingdom Tiles", color=0x0080c0)
-    for tile in self.tiles:
+    key = (kingdom.tilesVersion, kingdom.get_last_updated(self.db))
+    if kingdom.tilesEmbed is not None and kingdom.tilesEmbed[0] == key:
+      return kingdom.tilesEmbed[1]
+
+    title = "Kingdom Tiles" if len(self.kingdoms) == 1 else "Kingdom Tiles: {}".format(kingdom.name)
+    embed = discord.Embed(title=title, color=0x0080c0)
+    for tile in kingdom.tiles:
       embed.add_field(name=tile.get_coords(), value=str(tile), inline=True)
-    embed.set_footer(text="Last updated: {} UTC".format(self.db.get("last_updated","Unknown")))
+    embed.set_footer(text="Last updated: {} UTC".format(key[1]))
+    kingdom.tilesEmbed = (key, embed)
     return embed
 
 
-  async def post_tile_update(self, gained, lost):
+  async def post_tile_update(self, kingdom, gained, lost):
     '''
     Sends an embed message to the notification channel if 
     any tiles were lost or gained since the last update. 
@@ -214,288 +451,132 @@ class QueslarBot(commands.Bot):
       return
     
     if len(gained) != 0:
-      gainedMsg = discord.Embed(title="Tile(s) Gained:", color=0x00ff00)
-      for coords, boostType in gained:
-        gainedMsg.add_field(name=coords, value=boostType, inline=False)
-      try:
-        await self.notificationChannel.send(embed=gainedMsg)
-      except AttributeError:
-        print("Error: Could not send message to notification channel. Bot could not find the specified channel.")
-
+      self.notify(kingdom, "Tile(s) Gained:", gained, color=0x00ff00)
 
     if len(lost) != 0:
-      lostMsg = discord.Embed(title="Tile(s) Lost:", color=0xce0000)
-      for coords, boostType in lost:
-        lostMsg.add_field(name=coords, value=boostType, inline=False)
-      try:
-        await self.notificationChannel.send("@here", embed=lostMsg)
-      except AttributeError:
-        print("Error: Could not send message to notification channel. Bot could not find the specified channel.")
+      self.notify(kingdom, "Tile(s) Lost:", lost, color=0xce0000, mention=True)
 
-  async def stop_timer(self):
-    self.scheduler.pause()
-    self.scheduler.remove_job("exploration")
-    self.scheduler.remove_job("explorationReminder")
+  async def stop_timer(self, kingdom):
+    kingdom.timerStopped = True
+    self.cancel_alerts(kingdom)
+    await self.timers.save()
 
-  async def restart_timer(self):
-    self.scheduler.resume()
-    await self.update_info()
+  async def restart_timer(self, kingdom):
+    kingdom.timerStopped = False
+    await self.update_info(kingdom)
 
-  def get_exploration_timer(self):
-    if len(self.scheduler.get_jobs()) == 0:
+  def get_exploration_timer(self, kingdom):
+    if kingdom.timerStopped or self.timers.get((kingdom.name, "exploration")) is None:
       return "The timer has stopped."
 
-    return str(self.exploration)
+    return str(kingdom.exploration)
   
 
   async def get_market(self):
     '''
-    Return a formatted message containing market prices
+    Return a formatted message containing market prices.
+    It is only reformatted after the prices change.
     '''
-    return """Last updated: {}
+    key = (self.market.version, self.db["market_last_updated"])
+    if self.marketMessage is None or self.marketMessage[0] != key:
+      self.marketMessage = (key, """Last updated: {}
     ```
-{}```""".format(self.db["market_last_updated"], str(self.market))
+{}```""".format(key[1], str(self.market)))
+    return self.marketMessage[1]
 
 
-  async def get_player_investments(self, key):
-    if self.market.is_outdated():
+  async def refresh_market(self):
+    '''
+    Updates the market prices if they are outdated.
+    Returns False if they could not be updated.
+    '''
+    if await self.market.is_outdated():
       if not await self.market.update():
         print("Market could not update.")
-        return "Market could not update."
+        return False
       else:
-        self.db["market_last_updated"] = db.db_get("market_last_updated", "Unknown")
+        self.db["market_last_updated"] = await db.db_get("market_last_updated", "Unknown")
+    return True
+
+
+  async def add_roster_member(self, key):
+    '''
+    Adds a player's API key to the village roster.
+    Returns a message describing the result.
+    '''
+    roster = self.db.get("roster", [])
+    if key in roster:
+      return "This key is already in the roster."
 
     data = await self.get_qs_data(key)
     if not data: return "Player key is not valid."
 
-    toStr = self.market.price_to_str #Because the function name is long
-
-    # Basic info + currencies
-    currency = data["currency"]
-    village = data["village"]["overview"]["name"] if data["village"] else "Not in a village"
-    username = "{}({})".format(data["player"]["username"],currency["id"])
-    level = data["skills"]["battling"]
-    goldInv = "{} ({})".format(toStr(currency["gold"]), toStr(currency["bank_gold"]))
-    creditsInv = "{} ({})".format(toStr(currency["credits"]),toStr(currency["bank_credits"]))
-    relicsInv = "{} ({})".format(toStr(currency["relics"]), toStr(currency["bank_relics"]))
-
-    msg = """```Village: {}\nName: {}\nLevel: {}\nGold: {}\nCredits: {}\nRelics: {}
----------------------------------------------------------------------\n""".format(
-      village, username, level, goldInv, creditsInv, relicsInv
-    )
-
-    # Basic stats
-    stats = data["stats"]
-    msg += """Strength: {}\nHealth: {}\nAgility: {}\nDexterity: {}
----------------------------------------------------------------------\n""".format(
-      stats["strength"], stats["health"], stats["agility"], stats["dexterity"]
-    )
-
-    # Investment
-    ### Partners
-    partners = data["partners"]
-    partnerInvestment = currency["shattered_partner_gold"]
-    for partner in partners:
-      partnerInvestment += calc.getPartnerInvestment(partner["speed"],partner["intelligence"])
-
-    partnerCost = calc.getUnitInvestment(len(partners))
-
-    ### Pets
-    petCost = calc.getUnitInvestment(len(data["pets"]))
-    petInvestment = calc.getPetInvestment(data["playerPetsData"])
-
-    ### Fighters
-    fighters = data["fighters"]
-    fighterInvestment = currency["shattered_fighter_gold"]
-    fighterCost = calc.getUnitInvestment(len(fighters) - 1)
-
-    for fighter in fighters:
-      fighterInvestment += calc.getFighterInvestment(fighter)
-
-    ### Equipment Slots
-    eqSlots = data["equipmentSlots"]
-    eqSlotLevels = [eqSlots["left_hand_level"], eqSlots["right_hand_level"], eqSlots["head_level"], eqSlots["body_level"], eqSlots["hands_level"], eqSlots["legs_level"], eqSlots["feet_level"]]
-    matPrice = (float(self.market.prices["meat"]) + float(self.market.prices["iron"]) + \
-        float(self.market.prices["wood"]) + float(self.market.prices["stone"])) #Used later
-    eqSlotInvestment = calc.getEqSlotInvestment(eqSlotLevels) * matPrice
-    
-    ### Cave
-    cave = data["fighterCaveTools"]
-    caveInvestment = 0
-    caveUpgrades = ["archeology", "brush", "trowel", "map", "backpack", "torch", "scouting", "spade", "knife", "compass"]
-
-    for tool in caveUpgrades:
-      caveInvestment += calc.getCaveInvestment(cave[tool], matPrice, float(self.market.prices["diamonds"]))
-   
-    ### Relics
-    boosts = data["boosts"]
-    relicPrice = float(self.market.prices["relics"])
-    battleBoostTypes = ["critChance", "critDamage", "multistrike", "healing", "defense"]
-    partnerTypes = ["hunting_boost","mining_boost","woodcutting_boost","stonecarving_boost"]
-    relicBattleInvestment = currency["shattered_battling_relics"] * relicPrice
-    relicPartnerInvestment = currency["shattered_partner_relics"] * relicPrice
-
-    for boost in battleBoostTypes:
-      relicBattleInvestment += round(calc.getRelicInvestment(boosts[boost]) * relicPrice)
-
-    for boost in partnerTypes:
-      relicPartnerInvestment += round(calc.getRelicInvestment(boosts[boost]) * relicPrice)
-    
-    ### House
-    house = data["house"]
-    houseUpgrades = ["chairs", "stove", "sink", "basket", "pitchfork", "shed", "fountain", "tools", "barrel"]
-    livingRoom = ["table","candlestick","carpet","couch"]
-    houseInvestment = 0
-
-    for deco in houseUpgrades:
-      houseInvestment += calc.getHouseInvestment(house[deco]) * matPrice
-    for deco in livingRoom:
-      houseInvestment += calc.getHouseInvestment(house[deco], 5000000) * matPrice
-
-    ### Homesteads (HS)
-    homestead = data["playerHomesteadData"]
-    hsLevels = {
-      "fishing_level": "meat",
-      "mine_level": "iron",
-      "logging_level": "wood",
-      "farm_level": "stone"
-    }
-    homesteadInvestment = 0
-
-    for type in hsLevels:
-      homesteadInvestment += calc.getHomesteadInvestment(homestead[type]) * \
-        float(self.market.prices[hsLevels[type]])
-    # Add plot investment too
-    homesteadInvestment += calc.getPlotInvestment(homestead["plots"]) * matPrice
-    
-    ### Pet experience (from decorations)
-    decos = data.get("playerHomesteadDecorations", [])
-    petExp = 0
-    for decoration in decos:
-      if decoration.get("pet_exp_boost", 0) > 0:
-        petExp += decoration.get("pet_exp_boost", 0)
-
-
-    msg += """Partner Costs: {} ({})\nPartner Boosts: {}\n
-Fighter Costs: {} ({})\nFighter Boosts: {}\nCave Investment: {}\n
-Pet Costs: {} ({})\nPet Boosts: {}\n
-Equipment Slots: {}\nPartner Relic Boosts: {}
-Battle Relic Boosts: {}\nTotal Relic Boosts: {}\nHome Investment: {}\n
-Homestead Investment: {}\nHomestead Levels: M: {}, I: {}, W: {}, S: {}
-Total Pet Exp Boost: {}%
----------------------------------------------------------------------\n""".format(
-      toStr(partnerCost), len(partners), toStr(partnerInvestment),
-      toStr(fighterCost), len(fighters), toStr(fighterInvestment), 
-      toStr(caveInvestment),
-      toStr(petCost), len(data["pets"]), toStr(petInvestment), 
-      toStr(eqSlotInvestment), toStr(relicPartnerInvestment), 
-      toStr(relicBattleInvestment), toStr(relicPartnerInvestment+relicBattleInvestment),
-      toStr(houseInvestment), toStr(homesteadInvestment),
-      homestead["fishing_level"], homestead["mine_level"],
-      homestead["logging_level"], homestead["farm_level"],
-      petExp
-    )
-    
+    self.db["roster"] = roster + [key]
+    self.db.flush_later()
+    return "Added {} to the roster.".format(data["player"]["username"])
 
-    totalInvestment = partnerInvestment + partnerCost + petCost + \
-      fighterInvestment + fighterCost + eqSlotInvestment + \
-      relicBattleInvestment + relicPartnerInvestment + \
-      houseInvestment + homesteadInvestment + caveInvestment
-
-    msg += """Self Investment Total: {}
----------------------------------------------------------------------\n""".format(
-      toStr(totalInvestment)
-    )
-
-
-    ### Enchants and Equipment
-    equipment = data["equipmentEquipped"]
-    enchants = {
-      "gold": [0,0],
-      "experience": [0,0],
-      "drop": [0,0],
-      "stat": [0,0],
-      "meat": [0,0],
-      "iron": [0,0],
-      "wood": [0,0],
-      "stone": [0,0]
-    }
-    equipmentStats = []
-    eqDamage = 0
-    eqDefense = 0
-    eqTiers = {
-      0: 1,
-      1: 1.15, 
-      2: 1.25,
-      3: 1.5,
-      4: 1.65,
-      5: 1.9,
-      6: 2.1,
-      7: 2.3,
-      8: 2.5,
-      9: 3,
-      10: 4
-    }
-
-    for piece in equipment:
-      if piece.get("enchant_type","") in enchants:
-        enchants[piece["enchant_type"]][1] = piece["enchant_value"]**0.425 / 2 + \
-                                             enchants[piece["enchant_type"]][1]
-        enchants[piece["enchant_type"]][0] += 1
-
-      # Adding tier bonus to stats
-      totalStats = round(piece["strength"] * eqTiers[piece["strength_tier"]] + \
-        piece["health"] * eqTiers[piece["health_tier"]] + \
-        piece["agility"] * eqTiers[piece["agility_tier"]] + \
-        piece["dexterity"] * eqTiers[piece["dexterity_tier"]])
-      equipmentStats.append(totalStats)
-
-      eqDamage += round(piece["damage"] * eqTiers[piece["damage_tier"]])
-      eqDefense += round(piece["defense"] * eqTiers[piece["defense_tier"]]) #TODO: Display proper dmg/def values including pet+gods
-    
 
-    msg += """Exp Enchants: {}% ({})\nGold Enchants: {}% ({})
-Drop Enchants: {}% ({})\nStat Enchants: {}% ({})
-Res Enchants: {}% ({})
----------------------------------------------------------------------\n""".format(
-      round(enchants["experience"][1],2),round(enchants["experience"][0],2),
-      round(enchants["gold"][1],2),round(enchants["gold"][0],2),
-      round(enchants["drop"][1],2),round(enchants["drop"][0],2),
-      round(enchants["stat"][1],2),round(enchants["stat"][0],2),
-      round(enchants["meat"][1]+enchants["iron"][1]+enchants["wood"][1]+enchants["stone"][1],2),
-      round(enchants["meat"][0]+enchants["iron"][0]+enchants["wood"][0]+enchants["stone"][0],2)
-    )
-
-    msg += """Damage: {:,}    Defense: {:,}
-Left Hand Stats: {:,} ({}+{})\nRight Hand Stats: {:,} ({}+{})
-Helmet Stats: {:,} ({}+{})\nArmor Stats: {:,} ({}+{})\nGloves Stats: {:,} ({}+{})
-Legging Stats: {:,} ({}+{})\nBoots Stats: {:,} ({}+{})
----------------------------------------------------------------------\n""".format( 
-      eqDamage, eqDefense,
-      equipmentStats[0], eqSlotLevels[0], equipment[0]["slot_tier"],
-      equipmentStats[1], eqSlotLevels[1], equipment[1]["slot_tier"],
-      equipmentStats[2], eqSlotLevels[2], equipment[2]["slot_tier"],
-      equipmentStats[3], eqSlotLevels[3], equipment[3]["slot_tier"],
-      equipmentStats[4], eqSlotLevels[4], equipment[4]["slot_tier"],
-      equipmentStats[5], eqSlotLevels[5], equipment[5]["slot_tier"],
-      equipmentStats[6], eqSlotLevels[6], equipment[6]["slot_tier"]
-    )
-
-    ### Income info
-    ## Gold
-    goldPerDay = calc.getPersonalGoldIncome(data, enchants["gold"][1] / 100) * 14400
-    # Res
-    resPerDay = calc.getPartnerResIncomeHr(data) * 24
-    # Relics
-    relicsPerDay = calc.getRelicIncomeHr(data, enchants["drop"][1] / 100) * 24
-
-    msg += """Income (Party not included)
-Gold/day: {} ({:,})
-Res/day: {} ({:,})
-Relics/day: {} ({:,})```""".format( 
-      toStr(goldPerDay), goldPerDay, 
-      toStr(resPerDay), resPerDay, 
-      toStr(relicsPerDay), relicsPerDay
-    )
-    
-    return msg
+  def remove_roster_member(self, key):
+    '''
+    Removes a player's API key from the village roster.
+    Returns a message describing the result.
+    '''
+    roster = self.db.get("roster", [])
+    if key not in roster:
+      return "This key is not in the roster."
+
+    self.db["roster"] = [member for member in roster if member != key]
+    self.db.flush_later()
+    return "Removed the key from the roster."
+
+
+  async def get_roster_report(self):
+    '''
+    Returns an embed ranking every roster member by total
+    investment, along with their income per day.
+    Members are fetched concurrently, so this takes about as
+    long as the slowest fetch.
+    '''
+    embed = discord.Embed(title="Village Roster", color=0x0080c0)
+    keys = self.db.get("roster", [])
+    if not keys:
+      embed.description = "The roster is empty. Use >roster add [APIKey] to add members."
+      return embed
+    if not await self.refresh_market():
+      embed.description = "Market could not update."
+      return embed
+
+    players = [data for data in await self.api.get_players(keys, self.rosterConcurrency) if data]
+    results = batch.getBatchResults(players, self.market.prices)
+    order = sorted(range(len(players)), key=lambda i: results["totalInvestment"][i], reverse=True)
+
+    toStr = self.market.price_to_str
+    rowFormat = "{:>2} {:<16} {:>8} {:>8} {:>8} {:>8}"
+    lines = [rowFormat.format("#", "Name", "Total", "Gold/d", "Res/d", "Relic/d")]
+    for rank, i in enumerate(order, 1):
+      lines.append(rowFormat.format(
+        rank, players[i]["player"]["username"][:16],
+        toStr(results["totalInvestment"][i]), toStr(results["goldPerDay"][i]),
+        toStr(results["resPerDay"][i]), toStr(results["relicsPerDay"][i])
+      ))
+
+    trim_lines(lines)
+    embed.description = "```\n{}```".format("\n".join(lines))
+    embed.set_footer(text="{} of {} members | Market last updated: {}".format(
+      len(players), len(keys), self.db.get("market_last_updated", "Unknown")
+    ))
+    return embed
+
+
+  async def get_player_investments(self, key):
+    '''
+    Returns the investment report of the player with the API key
+    '''
+    if not await self.refresh_market():
+      return "Market could not update."
+
+    data = await self.get_qs_data(key)
+    if not data: return "Player key is not valid."
+
+    investments = report.get_investment_report(data, self.market.prices, self.market.version)
+    return report.render_investment_report(investments)
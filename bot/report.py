@@ -0,0 +1,312 @@
+import time
+from collections import OrderedDict
+import calculator as calc
+from calculator import BATTLE_BOOSTS, PARTNER_BOOSTS, HOUSE_UPGRADES, LIVING_ROOM, CAVE_UPGRADES
+from market import Market
+
+# Builds the >player report. compute_investment_report does all of the
+# arithmetic and render_investment_report only formats the result, so a
+# computed report can be cached and rendered again for free.
+
+REPORT_CACHE_SIZE = 64
+REPORT_CACHE_TTL = 60 #Seconds, since VIP and gem boosts run out over time
+
+HOMESTEADS = {
+  "fishing_level": "meat",
+  "mine_level": "iron",
+  "logging_level": "wood",
+  "farm_level": "stone"
+}
+EQ_TIERS = {
+  0: 1,
+  1: 1.15,
+  2: 1.25,
+  3: 1.5,
+  4: 1.65,
+  5: 1.9,
+  6: 2.1,
+  7: 2.3,
+  8: 2.5,
+  9: 3,
+  10: 4
+}
+SEPARATOR = "---------------------------------------------------------------------\n"
+
+
+class InvestmentReport:
+  '''
+  The computed values of a >player report.
+  Amounts are numbers, they are only formatted by the renderer.
+  enchants maps an enchant type to (count, total boost %), and
+  the equipment tuples are in slot order, left hand to boots.
+  '''
+  __slots__ = (
+    "village", "username", "level", "gold", "bankGold", "credits", "bankCredits", "relics", "bankRelics",
+    "strength", "health", "agility", "dexterity",
+    "partnerCount", "partnerCost", "partnerInvestment",
+    "fighterCount", "fighterCost", "fighterInvestment", "caveInvestment",
+    "petCount", "petCost", "petInvestment", "eqSlotInvestment",
+    "relicPartnerInvestment", "relicBattleInvestment", "houseInvestment",
+    "homesteadInvestment", "homesteadLevels", "petExp", "totalInvestment",
+    "enchants", "eqDamage", "eqDefense", "equipmentStats", "eqSlotLevels", "slotTiers",
+    "goldPerDay", "resPerDay", "relicsPerDay", "text"
+  )
+
+  def __init__(self, **values):
+    self.text = None #Filled in by render_investment_report
+    for name, value in values.items():
+      setattr(self, name, value)
+
+
+def compute_investment_report(data, prices):
+  '''
+  Returns the InvestmentReport of the player data, valued
+  with the given market prices. Does no I/O.
+  '''
+  currency = data["currency"]
+  stats = data["stats"]
+  matPrice = float(prices["meat"]) + float(prices["iron"]) + float(prices["wood"]) + float(prices["stone"])
+  relicPrice = float(prices["relics"])
+
+  ### Partners
+  partners = data["partners"]
+  partnerInvestment = currency["shattered_partner_gold"]
+  for partner in partners:
+    partnerInvestment += calc.getPartnerInvestment(partner["speed"], partner["intelligence"])
+
+  ### Fighters
+  fighters = data["fighters"]
+  fighterInvestment = currency["shattered_fighter_gold"]
+  for fighter in fighters:
+    fighterInvestment += calc.getFighterInvestment(fighter)
+
+  ### Equipment Slots
+  eqSlots = data["equipmentSlots"]
+  eqSlotLevels = (eqSlots["left_hand_level"], eqSlots["right_hand_level"], eqSlots["head_level"], eqSlots["body_level"], eqSlots["hands_level"], eqSlots["legs_level"], eqSlots["feet_level"])
+
+  ### Cave
+  cave = data["fighterCaveTools"]
+  caveInvestment = 0
+  for tool in CAVE_UPGRADES:
+    caveInvestment += calc.getCaveInvestment(cave[tool], matPrice, float(prices["diamonds"]))
+
+  ### Relics
+  boosts = data["boosts"]
+  relicBattleInvestment = currency["shattered_battling_relics"] * relicPrice
+  relicPartnerInvestment = currency["shattered_partner_relics"] * relicPrice
+  for investment in calc.getRelicInvestments([boosts[boost] for boost in BATTLE_BOOSTS]):
+    relicBattleInvestment += round(investment * relicPrice)
+  for investment in calc.getRelicInvestments([boosts[boost] for boost in PARTNER_BOOSTS]):
+    relicPartnerInvestment += round(investment * relicPrice)
+
+  ### House
+  house = data["house"]
+  houseInvestment = 0
+  for deco in HOUSE_UPGRADES:
+    houseInvestment += calc.getHouseInvestment(house[deco]) * matPrice
+  for deco in LIVING_ROOM:
+    houseInvestment += calc.getHouseInvestment(house[deco], 5000000) * matPrice
+
+  ### Homesteads (HS)
+  homestead = data["playerHomesteadData"]
+  homesteadInvestment = 0
+  hsInvestments = calc.getHomesteadInvestments([homestead[type] for type in HOMESTEADS])
+  for type, investment in zip(HOMESTEADS, hsInvestments):
+    homesteadInvestment += investment * float(prices[HOMESTEADS[type]])
+  # Add plot investment too
+  homesteadInvestment += calc.getPlotInvestment(homestead["plots"]) * matPrice
+
+  ### Pet experience (from decorations)
+  petExp = 0
+  for decoration in data.get("playerHomesteadDecorations", []):
+    if decoration.get("pet_exp_boost", 0) > 0:
+      petExp += decoration.get("pet_exp_boost", 0)
+
+  report = InvestmentReport(
+    village = data["village"]["overview"]["name"] if data["village"] else "Not in a village",
+    username = "{}({})".format(data["player"]["username"], currency["id"]),
+    level = data["skills"]["battling"],
+    gold = currency["gold"], bankGold = currency["bank_gold"],
+    credits = currency["credits"], bankCredits = currency["bank_credits"],
+    relics = currency["relics"], bankRelics = currency["bank_relics"],
+    strength = stats["strength"], health = stats["health"],
+    agility = stats["agility"], dexterity = stats["dexterity"],
+    partnerCount = len(partners),
+    partnerCost = calc.getUnitInvestment(len(partners)),
+    partnerInvestment = partnerInvestment,
+    fighterCount = len(fighters),
+    fighterCost = calc.getUnitInvestment(len(fighters) - 1),
+    fighterInvestment = fighterInvestment,
+    caveInvestment = caveInvestment,
+    petCount = len(data["pets"]),
+    petCost = calc.getUnitInvestment(len(data["pets"])),
+    petInvestment = calc.getPetInvestment(data["playerPetsData"]),
+    eqSlotInvestment = calc.getEqSlotInvestment(eqSlotLevels) * matPrice,
+    relicPartnerInvestment = relicPartnerInvestment,
+    relicBattleInvestment = relicBattleInvestment,
+    houseInvestment = houseInvestment,
+    homesteadInvestment = homesteadInvestment,
+    homesteadLevels = tuple(homestead[type] for type in HOMESTEADS),
+    petExp = petExp,
+    eqSlotLevels = eqSlotLevels
+  )
+  report.totalInvestment = report.partnerInvestment + report.partnerCost + report.petCost + \
+    report.fighterInvestment + report.fighterCost + report.eqSlotInvestment + \
+    report.relicBattleInvestment + report.relicPartnerInvestment + \
+    report.houseInvestment + report.homesteadInvestment + report.caveInvestment
+
+  ### Enchants and Equipment
+  equipment = data["equipmentEquipped"]
+  enchants = {
+    "gold": [0,0],
+    "experience": [0,0],
+    "drop": [0,0],
+    "stat": [0,0],
+    "meat": [0,0],
+    "iron": [0,0],
+    "wood": [0,0],
+    "stone": [0,0]
+  }
+  equipmentStats = []
+  eqDamage = 0
+  eqDefense = 0
+
+  for piece in equipment:
+    if piece.get("enchant_type","") in enchants:
+      enchants[piece["enchant_type"]][1] = piece["enchant_value"]**0.425 / 2 + \
+                                           enchants[piece["enchant_type"]][1]
+      enchants[piece["enchant_type"]][0] += 1
+
+    # Adding tier bonus to stats
+    totalStats = round(piece["strength"] * EQ_TIERS[piece["strength_tier"]] + \
+      piece["health"] * EQ_TIERS[piece["health_tier"]] + \
+      piece["agility"] * EQ_TIERS[piece["agility_tier"]] + \
+      piece["dexterity"] * EQ_TIERS[piece["dexterity_tier"]])
+    equipmentStats.append(totalStats)
+
+    eqDamage += round(piece["damage"] * EQ_TIERS[piece["damage_tier"]])
+    eqDefense += round(piece["defense"] * EQ_TIERS[piece["defense_tier"]]) #TODO: Display proper dmg/def values including pet+gods
+
+  report.enchants = {enchant: tuple(value) for enchant, value in enchants.items()}
+  report.eqDamage = eqDamage
+  report.eqDefense = eqDefense
+  report.equipmentStats = tuple(equipmentStats)
+  report.slotTiers = tuple(piece["slot_tier"] for piece in equipment)
+
+  ### Income info
+  report.goldPerDay = calc.getPersonalGoldIncome(data, enchants["gold"][1] / 100) * 14400
+  report.resPerDay = calc.getPartnerResIncomeHr(data) * 24
+  report.relicsPerDay = calc.getRelicIncomeHr(data, enchants["drop"][1] / 100) * 24
+  return report
+
+
+reportCache = OrderedDict() #(payload id, prices version) -> (expiry, payload, InvestmentReport)
+
+def get_investment_report(data, prices, version):
+  '''
+  Returns the InvestmentReport of the player data, reusing the report
+  computed from the same payload object while the market version is
+  unchanged. The API client hands out the same payload object until
+  its cache entry expires, so the object identity stands for its contents.
+  '''
+  key = (id(data), version)
+  now = time.monotonic()
+  cached = reportCache.get(key)
+  if cached is not None and cached[0] > now and cached[1] is data:
+    reportCache.move_to_end(key)
+    return cached[2]
+
+  report = compute_investment_report(data, prices)
+  for expired in [k for k, v in reportCache.items() if v[0] <= now]: #Releases the payloads they hold
+    del reportCache[expired]
+  reportCache[key] = (now + REPORT_CACHE_TTL, data, report) #Holding data keeps its id from being reused
+  reportCache.move_to_end(key)
+  if len(reportCache) > REPORT_CACHE_SIZE:
+    reportCache.popitem(last=False)
+  return report
+
+
+def render_investment_report(report):
+  '''
+  Returns the report formatted as a Discord message.
+  The text is kept on the report, so rendering it again is free.
+  '''
+  if report.text is not None:
+    return report.text
+
+  toStr = Market.price_to_str #Because the function name is long
+  r = report
+
+  # Basic info + currencies
+  msg = """```Village: {}\nName: {}\nLevel: {}\nGold: {}\nCredits: {}\nRelics: {}
+{}""".format(
+    r.village, r.username, r.level,
+    "{} ({})".format(toStr(r.gold), toStr(r.bankGold)),
+    "{} ({})".format(toStr(r.credits), toStr(r.bankCredits)),
+    "{} ({})".format(toStr(r.relics), toStr(r.bankRelics)),
+    SEPARATOR
+  )
+
+  # Basic stats
+  msg += """Strength: {}\nHealth: {}\nAgility: {}\nDexterity: {}
+{}""".format(r.strength, r.health, r.agility, r.dexterity, SEPARATOR)
+
+  # Investment
+  msg += """Partner Costs: {} ({})\nPartner Boosts: {}\n
+Fighter Costs: {} ({})\nFighter Boosts: {}\nCave Investment: {}\n
+Pet Costs: {} ({})\nPet Boosts: {}\n
+Equipment Slots: {}\nPartner Relic Boosts: {}
+Battle Relic Boosts: {}\nTotal Relic Boosts: {}\nHome Investment: {}\n
+Homestead Investment: {}\nHomestead Levels: M: {}, I: {}, W: {}, S: {}
+Total Pet Exp Boost: {}%
+{}""".format(
+    toStr(r.partnerCost), r.partnerCount, toStr(r.partnerInvestment),
+    toStr(r.fighterCost), r.fighterCount, toStr(r.fighterInvestment),
+    toStr(r.caveInvestment),
+    toStr(r.petCost), r.petCount, toStr(r.petInvestment),
+    toStr(r.eqSlotInvestment), toStr(r.relicPartnerInvestment),
+    toStr(r.relicBattleInvestment), toStr(r.relicPartnerInvestment+r.relicBattleInvestment),
+    toStr(r.houseInvestment), toStr(r.homesteadInvestment),
+    *r.homesteadLevels,
+    r.petExp,
+    SEPARATOR
+  )
+
+  msg += """Self Investment Total: {}
+{}""".format(toStr(r.totalInvestment), SEPARATOR)
+
+  enchants = r.enchants
+  msg += """Exp Enchants: {}% ({})\nGold Enchants: {}% ({})
+Drop Enchants: {}% ({})\nStat Enchants: {}% ({})
+Res Enchants: {}% ({})
+{}""".format(
+    round(enchants["experience"][1],2),round(enchants["experience"][0],2),
+    round(enchants["gold"][1],2),round(enchants["gold"][0],2),
+    round(enchants["drop"][1],2),round(enchants["drop"][0],2),
+    round(enchants["stat"][1],2),round(enchants["stat"][0],2),
+    round(enchants["meat"][1]+enchants["iron"][1]+enchants["wood"][1]+enchants["stone"][1],2),
+    round(enchants["meat"][0]+enchants["iron"][0]+enchants["wood"][0]+enchants["stone"][0],2),
+    SEPARATOR
+  )
+
+  slots = []
+  for i in range(7):
+    slots += [r.equipmentStats[i], r.eqSlotLevels[i], r.slotTiers[i]]
+  msg += """Damage: {:,}    Defense: {:,}
+Left Hand Stats: {:,} ({}+{})\nRight Hand Stats: {:,} ({}+{})
+Helmet Stats: {:,} ({}+{})\nArmor Stats: {:,} ({}+{})\nGloves Stats: {:,} ({}+{})
+Legging Stats: {:,} ({}+{})\nBoots Stats: {:,} ({}+{})
+{}""".format(r.eqDamage, r.eqDefense, *slots, SEPARATOR)
+
+  ### Income info
+  msg += """Income (Party not included)
+Gold/day: {} ({:,})
+Res/day: {} ({:,})
+Relics/day: {} ({:,})```""".format(
+    toStr(r.goldPerDay), r.goldPerDay,
+    toStr(r.resPerDay), r.resPerDay,
+    toStr(r.relicsPerDay), r.relicsPerDay
+  )
+
+  report.text = msg
+  return msg
@@ -1,37 +1,75 @@
-import database as db
-
 class Tile:
-  def __init__(self,  tile):
-    self.id = tile["id"]
-    self.type, self.bonus = self.parse_tile(tile)
+  '''
+  A kingdom tile. The types and bonuses hold one entry per resource,
+  and the coords and label are computed once, since tiles are shown
+  far more often than they change.
+  '''
+  __slots__ = ("id", "type", "bonus", "coords", "label")
+
+  def __init__(self, id, type, bonus, mystery="???"):
+    self.id = id
+    self.type = tuple(type) #Mystery tiles are kept as "mystery" and labelled with the mystery type
+    self.bonus = tuple(bonus)
+    self.coords = "({},{})".format((id - 1) % 5 + 1, (id - 1) // 5 + 1) #(column,row) of the tile index
+    self.set_mystery(mystery)
+
+
+  @classmethod
+  def from_api(cls, tile, mystery="???"):
+    '''
+    Returns a Tile from the API tile data
+    '''
+    tileType, bonus = cls.parse_tile(tile)
+    return cls(tile["id"], tileType, bonus, mystery)
+
+
+  @classmethod
+  def from_compact(cls, data, mystery="???"):
+    '''
+    Returns a Tile from its to_compact list
+    '''
+    return cls(data[0], data[1::2], data[2::2], mystery)
+
+
+  def to_compact(self):
+    '''
+    Returns the tile as [id, type, bonus, type, bonus, ...],
+    which is all the bot stores about it
+    '''
+    data = [self.id]
+    for i in range(len(self.type)):
+      data += [self.type[i], self.bonus[i]]
+    return data
 
 
   def get_coords(self):
     '''
-    Returns a string representation of (column,row) 
+    Returns a string representation of (column,row)
     given the tile index
     '''
-    y = (self.id - 1) // 5 + 1
-    x = (self.id - 1) % 5 + 1
-    return "({},{})".format(x, y)  
+    return self.coords
+
 
-  
   def set_mystery(self, newMystery):
-    if self.type[0].startswith("mystery"):
-      self.type = ["mystery(" + newMystery + ")"]
+    '''
+    Labels mystery types with the new mystery type
+    '''
+    parts = []
+    for i in range(len(self.type)):
+      tileType = "mystery({})".format(newMystery) if self.type[i] == "mystery" else self.type[i]
+      parts.append("{} {}%".format(tileType, self.bonus[i]))
+    self.label = ", ".join(parts)
 
 
-  def parse_tile(self, tile):
+  @staticmethod
+  def parse_tile(tile):
     if tile["type"] == "Minor" or tile["name"] == "Wild":
-      if tile["resource_one_type"] == "mystery":
-        tileType = ["mystery({})".format(db.db_get("mystery", "???"))]
-      else:
-        tileType = [tile["resource_one_type"]]
-      bonus = [tile["resource_one_value"]]
+      tileType = (tile["resource_one_type"],)
+      bonus = (tile["resource_one_value"],)
 
     else:  #Major tile with 3 types
-      tileType = [tile["resource_one_type"],tile["resource_two_type"],tile["resource_three_type"]]
-      bonus = [tile["resource_one_value"],tile["resource_two_value"],tile["resource_three_value"]]
+      tileType = (tile["resource_one_type"],tile["resource_two_type"],tile["resource_three_type"])
+      bonus = (tile["resource_one_value"],tile["resource_two_value"],tile["resource_three_value"])
     return tileType, bonus
 
 
@@ -39,9 +77,20 @@ class Tile:
     '''
     Returns the string representation of a tile
     '''
-    s = "{} {}%".format(self.type[0], self.bonus[0])
-    for i in range(1, len(self.type)):
-      s += ", {} {}%".format(self.type[i], self.bonus[i])
-    
-    return s
-    
\ No newline at end of file
+    return self.label
+
+
+def build_tiles(tiles, mystery="???"):
+  '''
+  Returns a list of Tiles from the API tile data, labelling
+  mystery tiles with the given mystery type.
+  '''
+  return [Tile.from_api(tile, mystery) for tile in tiles]
+
+
+def load_tiles(tiles, mystery="???"):
+  '''
+  Returns a list of Tiles from the stored tiles. Tiles stored as
+  API data by older versions of the bot are read as well.
+  '''
+  return [Tile.from_api(tile, mystery) if isinstance(tile, dict) else Tile.from_compact(tile, mystery) for tile in tiles]
@@ -0,0 +1,161 @@
+import asyncio
+import heapq
+import itertools
+import json
+from datetime import datetime
+import database as db
+
+class TimerEngine:
+  '''
+  Runs coroutine functions at given UTC times.
+  Timers are keyed, e.g. by (kingdom, event), and kept in a min-heap.
+  Rescheduling or cancelling a timer only updates the key's entry,
+  and the outdated heap entry is skipped once it reaches the top.
+  With a name, the keys and times of the timers are saved in the
+  database hash of that name, so they can be restored after a restart.
+  '''
+  def __init__(self, name=None):
+    self.name = name
+    self.dirty = set() #Keys changed since the last save
+    self.heap = [] #(time, sequence, key)
+    self.timers = {} #key -> (time, sequence, callback, args)
+    self.sequence = itertools.count() #Breaks ties and tells outdated heap entries apart
+    self.wakeup = None #Event created in start, inside the event loop
+    self.task = None
+
+
+  def start(self):
+    self.wakeup = asyncio.Event()
+    self.task = asyncio.ensure_future(self.run())
+
+
+  def stop(self):
+    if self.task is not None:
+      self.task.cancel()
+
+
+  def schedule(self, key, time, callback, *args):
+    '''
+    Runs callback(*args) at time, replacing any timer with the same key
+    '''
+    sequence = next(self.sequence)
+    self.timers[key] = (time, sequence, callback, args)
+    self.dirty.add(key)
+    heapq.heappush(self.heap, (time, sequence, key))
+    if len(self.heap) > 2 * len(self.timers) + 64:
+      self.compact()
+    if self.heap[0][1] == sequence and self.wakeup is not None:
+      self.wakeup.set() #New earliest timer, so the sleep must be shortened
+
+
+  def cancel(self, key):
+    '''
+    Cancels the timer. Returns True if there was one.
+    '''
+    self.dirty.add(key)
+    return self.timers.pop(key, None) is not None
+
+
+  def cancel_prefix(self, prefix):
+    '''
+    Cancels every timer whose key starts with the prefix tuple.
+    Returns how many there were.
+    '''
+    keys = [key for key in self.timers if key[:len(prefix)] == prefix]
+    for key in keys:
+      self.cancel(key)
+    return len(keys)
+
+
+  def get(self, key):
+    '''
+    Returns the time the timer runs at, or None if there is no such timer
+    '''
+    timer = self.timers.get(key)
+    return timer[0] if timer else None
+
+
+  def __len__(self):
+    return len(self.timers)
+
+
+  def compact(self):
+    '''
+    Rebuilds the heap without the outdated entries
+    '''
+    self.heap = [(timer[0], timer[1], key) for key, timer in self.timers.items()]
+    heapq.heapify(self.heap)
+
+
+  def pop_outdated(self):
+    '''
+    Drops heap entries of cancelled or rescheduled timers from the top
+    '''
+    while self.heap:
+      time, sequence, key = self.heap[0]
+      timer = self.timers.get(key)
+      if timer is not None and timer[1] == sequence:
+        return
+      heapq.heappop(self.heap)
+
+
+  async def run(self):
+    '''
+    Sleeps until the earliest timer is due and runs it
+    '''
+    while True:
+      self.pop_outdated()
+      self.wakeup.clear()
+      if not self.heap:
+        await self.wakeup.wait()
+        continue
+
+      delay = (self.heap[0][0] - datetime.utcnow()).total_seconds()
+      if delay > 0:
+        try:
+          await asyncio.wait_for(self.wakeup.wait(), timeout=delay)
+        except asyncio.TimeoutError:
+          pass
+        continue
+
+      time, sequence, key = heapq.heappop(self.heap)
+      time, sequence, callback, args = self.timers.pop(key)
+      self.dirty.add(key)
+      asyncio.ensure_future(self.fire(key, callback, args))
+      if not self.heap or self.heap[0][0] > datetime.utcnow():
+        await self.save() #Once every due timer has fired
+
+
+  async def save(self):
+    '''
+    Writes the changed timers to the database in one pipelined write
+    '''
+    if self.name is None or not self.dirty: return
+
+    keys, self.dirty = self.dirty, set()
+    try:
+      await db.db_hwrite(
+        self.name,
+        {json.dumps(key):self.timers[key][0].isoformat() for key in keys if key in self.timers},
+        [json.dumps(key) for key in keys if key not in self.timers]
+      )
+    except Exception as e:
+      self.dirty |= keys #Try again on the next save
+      print("Failed to save timers: {}".format(repr(e)))
+
+
+  async def load(self):
+    '''
+    Returns the saved timers as a dict of key to time.
+    Keys are returned as tuples.
+    '''
+    if self.name is None: return {}
+    saved = await db.db_hgetall(self.name)
+    return {tuple(json.loads(field)):datetime.fromisoformat(time) for field, time in saved.items()}
+
+
+  async def fire(self, key, callback, args):
+    try:
+      await callback(*args)
+    except Exception as e:
+      print("Timer {} failed: {}".format(key, repr(e)))
@@ -0,0 +1,34 @@
+from datetime import datetime
+from functools import lru_cache
+
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S.000Z" #e.g. 2021-04-07T06:13:29.000Z
+NEVER_TIMESTAMP = "0000-00-00 00:00:00" #Sent by the API for timers that never ran
+NEVER = datetime(2000, 1, 1) #Parsed value of NEVER_TIMESTAMP, always in the past
+
+@lru_cache(maxsize=1024)
+def parse_timestamp(timestamp):
+  '''
+  Returns the datetime of an API timestamp.
+  The never sentinel and empty values are returned as NEVER.
+  '''
+  if not timestamp or timestamp == NEVER_TIMESTAMP:
+    return NEVER
+
+  # Fixed positions are much faster than strptime
+  if len(timestamp) == 24 and timestamp[10] == "T" and timestamp[19] == "." and timestamp[23] == "Z":
+    try:
+      return datetime(
+        int(timestamp[0:4]), int(timestamp[5:7]), int(timestamp[8:10]),
+        int(timestamp[11:13]), int(timestamp[14:16]), int(timestamp[17:19]),
+        int(timestamp[20:23]) * 1000
+      )
+    except ValueError:
+      pass
+  return datetime.strptime(timestamp, TIMESTAMP_FORMAT) #Raises on anything unexpected
+
+
+def is_future(timestamp):
+  '''
+  Returns True if the timestamp has not passed yet
+  '''
+  return datetime.utcnow() < parse_timestamp(timestamp)